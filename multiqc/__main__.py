@@ -10,9 +10,8 @@ $ python -m multiqc .
 
 from __future__ import print_function
 import click
-import pkg_resources
 from . import multiqc
-from .utils import config
+from .utils import config, registry
 
 
 def modify_usage_error(main_command):
@@ -44,7 +43,7 @@ def modify_usage_error(main_command):
 
 if __name__ == "__main__" or __name__ == "multiqc.__main__":
     # Add any extra plugin command line options
-    for entry_point in pkg_resources.iter_entry_points("multiqc.cli_options.v1"):
+    for entry_point in registry.entry_points("multiqc.cli_options.v1"):
         opt_func = entry_point.load()
         multiqc.run_cli = opt_func(multiqc.run_cli)
     # Modify the default click error handling
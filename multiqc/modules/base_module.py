@@ -4,8 +4,9 @@
 
 from __future__ import print_function
 from collections import OrderedDict
-import io
+from collections.abc import Mapping
 import fnmatch
+import functools
 import logging
 import markdown
 import mimetypes
@@ -13,7 +14,7 @@ import os
 import re
 import textwrap
 
-from multiqc.utils import report, config, util_functions
+from multiqc.utils import archives, report, config, result_cache, time_limits, util_functions
 
 logger = logging.getLogger(__name__)
 
@@ -73,11 +74,14 @@ class BaseMultiqcModule(object):
 
         self.sections = list()
 
-    def find_log_files(self, sp_key, filecontents=True, filehandles=False):
+    def find_log_files(self, sp_key, filecontents=True, filehandles=False, filelines=False):
         """
         Return matches log files of interest.
         :param sp_key: Search pattern key specified in config
         :param filehandles: Set to true to return a file handle instead of slurped file contents
+        :param filelines: Set to true to return an iterator over the lines of the file (without
+                          line endings, like str.splitlines()) instead of slurped file contents.
+                          Lines are read and decoded as they are used, so large files aren't held in memory.
         :return: Yields a dict with filename (fn), root directory (root), cleaned sample name
                  generated from the filename (s_name) and either the file contents or file handle
                  for the current matched file (f).
@@ -93,8 +97,8 @@ class BaseMultiqcModule(object):
         if isinstance(sp_key, dict):
             report.files[self.name] = list()
             for sf in report.searchfiles:
-                if report.search_file(sp_key, {"fn": sf[0], "root": sf[1]}, module_key=None):
-                    report.files[self.name].append({"fn": sf[0], "root": sf[1]})
+                if report.search_file(sp_key, report.SearchFile(sf[0], sf[1]), module_key=None):
+                    report.files[self.name].append(report.SearchFile(sf[0], sf[1]))
             sp_key = self.name
             logwarn = "Depreciation Warning: {} - Please use new style for find_log_files()".format(self.name)
             if len(report.files[self.name]) > 0:
@@ -105,64 +109,157 @@ class BaseMultiqcModule(object):
             logger.warning("Did not understand find_log_files() search key")
             return
 
-        for f in report.files[sp_key]:
-            # Make a note of the filename so that we can report it if something crashes
-            report.last_found_file = os.path.join(f["root"], f["fn"])
-
-            # Filter out files based on exclusion patterns
-            if path_filters_exclude and len(path_filters_exclude) > 0:
-                exlusion_hits = (fnmatch.fnmatch(report.last_found_file, pfe) for pfe in path_filters_exclude)
-                if any(exlusion_hits):
-                    logger.debug(
-                        "{} - Skipping '{}' as it matched the path_filters_exclude for '{}'".format(
-                            sp_key, f["fn"], self.name
+        def matched_files():
+            for f in report.files[sp_key]:
+                path = os.path.join(f["root"], f["fn"])
+
+                # Filter out files based on exclusion patterns
+                if path_filters_exclude and len(path_filters_exclude) > 0:
+                    exlusion_hits = (fnmatch.fnmatch(path, pfe) for pfe in path_filters_exclude)
+                    if any(exlusion_hits):
+                        logger.debug(
+                            "{} - Skipping '{}' as it matched the path_filters_exclude for '{}'".format(
+                                sp_key, f["fn"], self.name
+                            )
                         )
-                    )
-                    continue
+                        continue
 
-            # Filter out files based on inclusion patterns
-            if path_filters and len(path_filters) > 0:
-                inclusion_hits = (fnmatch.fnmatch(report.last_found_file, pf) for pf in path_filters)
-                if not any(inclusion_hits):
-                    logger.debug(
-                        "{} - Skipping '{}' as it didn't match the path_filters for '{}'".format(
-                            sp_key, f["fn"], self.name
+                # Filter out files based on inclusion patterns
+                if path_filters and len(path_filters) > 0:
+                    inclusion_hits = (fnmatch.fnmatch(path, pf) for pf in path_filters)
+                    if not any(inclusion_hits):
+                        logger.debug(
+                            "{} - Skipping '{}' as it didn't match the path_filters for '{}'".format(
+                                sp_key, f["fn"], self.name
+                            )
                         )
-                    )
-                    continue
-                else:
-                    logger.debug(
-                        "{} - Selecting '{}' as it matched the path_filters for '{}'".format(sp_key, f["fn"], self.name)
-                    )
+                        continue
+                    else:
+                        logger.debug(
+                            "{} - Selecting '{}' as it matched the path_filters for '{}'".format(
+                                sp_key, f["fn"], self.name
+                            )
+                        )
+                yield f
+
+        # Read the contents of the next few files in the background while the module parses this one
+        readahead = config.readahead_files is not None and config.readahead_files > 0
+        if filecontents and not filehandles and not filelines and readahead:
+            files = util_functions.read_ahead(
+                matched_files(),
+                self._read_ahead_log_file,
+                lambda f: f.get("filesize") or 0,
+                config.readahead_files,
+                config.readahead_max_bytes,
+            )
+        else:
+            files = ((f, None) for f in matched_files())
+
+        for f, contents in files:
+            # Stop here if the module has run out of time (config.module_timeout)
+            time_limits.check()
+
+            # Make a note of the filename so that we can report it if something crashes
+            report.last_found_file = os.path.join(f["root"], f["fn"])
 
             # Make a sample name from the filename
             f["sp_key"] = sp_key
             f["s_name"] = self.clean_s_name(f["fn"], f)
-            if filehandles or filecontents:
+            if filehandles or filelines or filecontents:
                 try:
+                    if contents is not None:
+                        contents = contents.result()
+                    if contents is not None:
+                        f["f"] = contents
+                        yield f
+                        continue
                     # Custom content module can now handle image files
                     (ftype, encoding) = mimetypes.guess_type(os.path.join(f["root"], f["fn"]))
                     if ftype is not None and ftype.startswith("image"):
-                        with io.open(os.path.join(f["root"], f["fn"]), "rb") as fh:
+                        with archives.open_file(f, "rb") as fh:
                             # always return file handles
                             f["f"] = fh
                             yield f
                     else:
-                        # Everything else - should be all text files
-                        with io.open(os.path.join(f["root"], f["fn"]), "r", encoding="utf-8") as fh:
+                        # Everything else - should be all text files (decompressed if config.decompress_logs)
+                        with archives.open_file(f) as fh:
                             if filehandles:
                                 f["f"] = fh
                                 yield f
+                            elif filelines:
+                                f["f"] = self._iter_log_lines(f, fh)
+                                yield f
                             elif filecontents:
                                 f["f"] = fh.read()
                                 yield f
-                except (IOError, OSError, ValueError, UnicodeDecodeError) as e:
+                except util_functions.file_read_errors as e:
                     if config.report_readerrors:
                         logger.debug("Couldn't open filehandle when returning file: {}\n{}".format(f["fn"], e))
                         f["f"] = None
             else:
                 yield f
 
+    @staticmethod
+    def _iter_log_lines(f, fh):
+        """
+        Lines of a log file for find_log_files(filelines=True), read as the module uses them.
+        The module has already started on the file by the time a read error (eg. invalid UTF-8)
+        comes up, so log it and stop there rather than breaking the module.
+        """
+        line_num = 0
+        try:
+            for line in util_functions.iter_lines(fh):
+                line_num += 1
+                yield line
+        except util_functions.file_read_errors as e:
+            logger.warning("Couldn't read all of {}, stopped after {} lines".format(f["fn"], line_num))
+            logger.debug(e)
+
+    @staticmethod
+    def _read_ahead_log_file(f):
+        """
+        Read a text log file for find_log_files() in a read-ahead thread.
+        Returns None for files that must be opened when they are used instead:
+        images, and files inside archives (which are read one at a time).
+        """
+        if "archive" in f:
+            return None
+        (ftype, encoding) = mimetypes.guess_type(os.path.join(f["root"], f["fn"]))
+        if ftype is not None and ftype.startswith("image"):
+            return None
+        with archives.open_file(f) as fh:
+            return fh.read()
+
+    def cached_parse(self, f, parse, *extra_key):
+        """
+        Parse a file from find_log_files(), reusing the result from a previous run
+        if config.parse_cache is set and the file hasn't changed since.
+        Use with find_log_files(filehandles=True), so that unchanged files aren't read.
+        :param f: File dict yielded by find_log_files()
+        :param parse: Function called with f to parse the file. Its result must be
+                      picklable and only depend on the file and config, as it is
+                      reused without calling the function.
+        :param extra_key: Any other values that the parsed result depends on
+        :return: The result of parse(f)
+        """
+        cache = result_cache.get_cache()
+        if cache is None or "archive" in f:
+            return parse(f)
+        path = os.path.abspath(os.path.join(f["root"], f["fn"]))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return parse(f)
+        key = (self.anchor, f["sp_key"], path)
+        fingerprint = result_cache.fingerprint(
+            [getattr(parse, "__qualname__", None), getattr(self, "mod_cust_config", {}), list(extra_key)]
+        )
+        found, result = cache.get(key, st, fingerprint)
+        if not found:
+            result = parse(f)
+            cache.set(key, st, fingerprint, result)
+        return result
+
     def add_section(
         self,
         name=None,
@@ -246,15 +343,13 @@ class BaseMultiqcModule(object):
         :config.prepend_dirs: boolean, whether to prepend dir name to s_name
         :return: The cleaned sample name, ready to be used
         """
-        s_name_original = s_name
-
         # Backwards compatability - if f is a string, it's probably the root (this used to be the second argument)
         if isinstance(f, str):
             root = f
             f = None
 
         # Set string variables from f if it was a dict from find_log_files()
-        if isinstance(f, dict):
+        if isinstance(f, Mapping):
             if "root" in f and root is None:
                 root = f["root"]
             if "fn" in f and filename is None:
@@ -262,104 +357,156 @@ class BaseMultiqcModule(object):
             if "sp_key" in f and seach_pattern_key is None:
                 seach_pattern_key = f["sp_key"]
 
-        # For modules setting s_name from file contents, set s_name back to the filename
-        # (if wanted in the config)
-        if filename is not None and (
-            config.use_filename_as_sample_name is True
-            or (
-                isinstance(config.use_filename_as_sample_name, list)
-                and seach_pattern_key is not None
-                and seach_pattern_key in config.use_filename_as_sample_name
-            )
-        ):
-            s_name = filename
-
-        # Set root to empty string if not known
-        if root is None:
-            root = ""
-
-        # if s_name comes from file contents, it may have a file path
-        # For consistency with other modules, we keep just the basename
-        s_name = os.path.basename(s_name)
-
-        # Prepend sample name with directory
-        if config.prepend_dirs:
-            sep = config.prepend_dirs_sep
-            root = root.lstrip(".{}".format(os.sep))
-            dirs = [d.strip() for d in root.split(os.sep) if d.strip() != ""]
-            if config.prepend_dirs_depth != 0:
-                d_idx = config.prepend_dirs_depth * -1
-                if config.prepend_dirs_depth > 0:
-                    dirs = dirs[d_idx:]
-                else:
-                    dirs = dirs[:d_idx]
-            if len(dirs) > 0:
-                s_name = "{}{}{}".format(sep.join(dirs), sep, s_name)
-
+        # The cleaning config is compiled the first time that the module cleans a name,
+        # and the cleaned names are cached, as modules often clean the same name several times
+        if getattr(self, "_s_name_cleaner", None) is None:
+            self._s_name_cleaner = functools.lru_cache(maxsize=65536)(self._compile_s_name_cleaning())
+        try:
+            return self._s_name_cleaner(s_name, root, filename, seach_pattern_key)
+        except TypeError:
+            # Unhashable sample name, so clean it without the cache
+            return self._s_name_cleaner.__wrapped__(s_name, root, filename, seach_pattern_key)
+
+    def _compile_s_name_cleaning(self):
+        """Build a function that cleans sample names with the current config, with the
+        cleaning patterns for this module and the sample name replacement regexes compiled.
+        Called by clean_s_name(), so config changes after the module's first cleaned name are not used.
+        """
+        use_filename = config.use_filename_as_sample_name
+        decompress_logs = config.decompress_logs
+        prepend_dirs = config.prepend_dirs
+        prepend_dirs_sep = config.prepend_dirs_sep
+        prepend_dirs_depth = config.prepend_dirs_depth
+
+        # Each cleaning step is a function taking and returning the sample name
+        clean_steps = []
+        clean_trim = []
         if config.fn_clean_sample_names:
-            # Split then take first section to remove everything after these matches
             for ext in config.fn_clean_exts:
                 # Check if this config is limited to a module
-                if "module" in ext:
-                    if type(ext["module"]) is str:
-                        ext["module"] = [ext["module"]]
-                    if not any([m == self.anchor for m in ext["module"]]):
+                if isinstance(ext, Mapping) and "module" in ext:
+                    ext_modules = [ext["module"]] if type(ext["module"]) is str else ext["module"]
+                    if self.anchor not in ext_modules:
                         continue
 
                 # Go through different filter types
                 if type(ext) is str:
                     ext = {"type": "truncate", "pattern": ext}
                 if ext.get("type") == "truncate":
-                    s_name = s_name.split(ext["pattern"], 1)[0]
+                    # Split then take first section to remove everything after these matches
+                    clean_steps.append(lambda s_name, pattern=ext["pattern"]: s_name.partition(pattern)[0])
                 elif ext.get("type") in ("remove", "replace"):
                     if ext["type"] == "replace":
                         logger.warning(
                             "use 'config.fn_clean_sample_names.remove' instead "
                             "of 'config.fn_clean_sample_names.replace' [deprecated]"
                         )
-                    s_name = s_name.replace(ext["pattern"], "")
+                    clean_steps.append(lambda s_name, pattern=ext["pattern"]: s_name.replace(pattern, ""))
                 elif ext.get("type") == "regex":
-                    s_name = re.sub(ext["pattern"], "", s_name)
+                    clean_steps.append(lambda s_name, regex=re.compile(ext["pattern"]): regex.sub("", s_name))
                 elif ext.get("type") == "regex_keep":
-                    match = re.search(ext["pattern"], s_name)
-                    s_name = match.group() if match else s_name
+
+                    def regex_keep(s_name, regex=re.compile(ext["pattern"])):
+                        match = regex.search(s_name)
+                        return match.group() if match else s_name
+
+                    clean_steps.append(regex_keep)
                 elif ext.get("type") is None:
                     logger.error('config.fn_clean_exts config was missing "type" key: {}'.format(ext))
                 else:
                     logger.error("Unrecognised config.fn_clean_exts type: {}".format(ext.get("type")))
+            clean_trim = list(config.fn_clean_trim)
+
+        # Hard replacements that are set with --replace-names, as (search, replace, compiled regex)
+        replacements = []
+        for s_name_search, s_name_replace in (config.sample_names_replace or {}).items():
+            s_name_regex = None
+            if config.sample_names_replace_regex:
+                try:
+                    s_name_regex = re.compile(s_name_search)
+                except re.error as e:
+                    logger.error("Error with sample name replacement regex: {}".format(e))
+                    continue
+            replacements.append((s_name_search, s_name_replace, s_name_regex))
+        replace_exact = config.sample_names_replace_exact
+        replace_complete = config.sample_names_replace_complete
+
+        def clean(s_name, root, filename, seach_pattern_key):
+            s_name_original = s_name
+
+            # For modules setting s_name from file contents, set s_name back to the filename
+            # (if wanted in the config)
+            if filename is not None and (
+                use_filename is True
+                or (
+                    isinstance(use_filename, list)
+                    and seach_pattern_key is not None
+                    and seach_pattern_key in use_filename
+                )
+            ):
+                s_name = filename
+
+            # Set root to empty string if not known
+            if root is None:
+                root = ""
+
+            # if s_name comes from file contents, it may have a file path
+            # For consistency with other modules, we keep just the basename
+            s_name = os.path.basename(s_name)
+
+            # Compressed logs are read as if they weren't compressed, so drop the extension (but not from archives)
+            if decompress_logs and not archives.is_archive(s_name):
+                c_ext = util_functions.compression_ext(s_name)
+                if c_ext is not None:
+                    s_name = s_name[: -len(c_ext)]
+
+            # Prepend sample name with directory
+            if prepend_dirs:
+                root = root.lstrip(".{}".format(os.sep))
+                dirs = [d.strip() for d in root.split(os.sep) if d.strip() != ""]
+                if prepend_dirs_depth != 0:
+                    d_idx = prepend_dirs_depth * -1
+                    if prepend_dirs_depth > 0:
+                        dirs = dirs[d_idx:]
+                    else:
+                        dirs = dirs[:d_idx]
+                if len(dirs) > 0:
+                    s_name = "{}{}{}".format(prepend_dirs_sep.join(dirs), prepend_dirs_sep, s_name)
+
+            for clean_step in clean_steps:
+                s_name = clean_step(s_name)
             # Trim off characters at the end of names
-            for chrs in config.fn_clean_trim:
+            for chrs in clean_trim:
                 if s_name.endswith(chrs):
                     s_name = s_name[: -len(chrs)]
                 if s_name.startswith(chrs):
                     s_name = s_name[len(chrs) :]
 
-        # Remove trailing whitespace
-        s_name = s_name.strip()
+            # Remove trailing whitespace
+            s_name = s_name.strip()
 
-        # If we cleaned back to an empty string, just use the original value
-        if s_name == "":
-            s_name = s_name_original
+            # If we cleaned back to an empty string, just use the original value
+            if s_name == "":
+                s_name = s_name_original
 
-        # Do any hard replacements that are set with --replace-names
-        if config.sample_names_replace:
-            for s_name_search, s_name_replace in config.sample_names_replace.items():
+            # Do any hard replacements that are set with --replace-names
+            for s_name_search, s_name_replace, s_name_regex in replacements:
                 try:
                     # Skip if we're looking for exact matches only
-                    if config.sample_names_replace_exact:
+                    if replace_exact:
                         # Simple strings
-                        if not config.sample_names_replace_regex and s_name != s_name_search:
+                        if s_name_regex is None and s_name != s_name_search:
                             continue
                         # regexes
-                        if config.sample_names_replace_regex and not re.fullmatch(s_name_search, s_name):
+                        if s_name_regex is not None and not s_name_regex.fullmatch(s_name):
                             continue
                     # Replace - regex
-                    if config.sample_names_replace_regex:
-                        s_name = re.sub(s_name_search, s_name_replace, s_name)
+                    if s_name_regex is not None:
+                        s_name = s_name_regex.sub(s_name_replace, s_name)
                     # Replace - simple string
                     else:
                         # Complete name swap
-                        if config.sample_names_replace_complete:
+                        if replace_complete:
                             if s_name_search in s_name:
                                 s_name = s_name_replace
                         # Partial substring replace
@@ -368,7 +515,9 @@ class BaseMultiqcModule(object):
                 except re.error as e:
                     logger.error("Error with sample name replacement regex: {}".format(e))
 
-        return s_name
+            return s_name
+
+        return clean
 
     def ignore_samples(self, data):
         """Strip out samples which match `sample_names_ignore`"""
@@ -442,6 +591,9 @@ class BaseMultiqcModule(object):
                 s_name = f["s_name"]
             if source is None:
                 source = os.path.abspath(os.path.join(f["root"], f["fn"]))
+                # Other paths to the same file that weren't searched (see config.dedupe_files)
+                if source in report.file_aliases:
+                    source = "; ".join([source] + report.file_aliases[source])
             report.data_sources[module][section][s_name] = source
         except AttributeError:
             logger.warning("Tried to add data source for {}, but was missing fields data".format(self.name))
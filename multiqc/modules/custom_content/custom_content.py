@@ -4,6 +4,7 @@
 
 from __future__ import print_function
 import base64
+import io
 from collections import defaultdict, OrderedDict
 import logging
 import json
@@ -12,7 +13,7 @@ import re
 import yaml
 
 from multiqc import config
-from multiqc.utils import report
+from multiqc.utils import report, util_functions, yaml_cache
 from multiqc.modules.base_module import BaseMultiqcModule
 from multiqc.plots import table, bargraph, linegraph, scatter, heatmap, beeswarm
 
@@ -22,7 +23,7 @@ log = logging.getLogger(__name__)
 # Load YAML as an ordered dict
 # From https://stackoverflow.com/a/21912744
 def yaml_ordered_load(stream):
-    class OrderedLoader(yaml.SafeLoader):
+    class OrderedLoader(yaml_cache.SafeLoader):
         pass
 
     def construct_mapping(loader, node):
@@ -423,7 +424,7 @@ def _find_file_header(f):
         return None
     hconfig = None
     try:
-        hconfig = yaml.safe_load("\n".join(hlines))
+        hconfig = yaml_cache.safe_load("\n".join(hlines))
         assert isinstance(hconfig, dict)
     except yaml.YAMLError as e:
         log.warning("Could not parse comment file header for MultiQC custom content: {}".format(f["fn"]))
@@ -503,7 +504,9 @@ def _parse_txt(f, conf):
         sep = ","
     if conf["file_format"] == "tsv":
         sep = "\t"
-    lines = f["f"].splitlines()
+    # Go through the lines one at a time, rather than making a copy of the file contents split into lines
+    lines = util_functions.iter_lines(io.StringIO(f["f"], newline=None))
+    num_lines = 0
     d = []
 
     # Check for special case - HTML
@@ -516,6 +519,7 @@ def _parse_txt(f, conf):
     # Not HTML, need to parse data
     ncols = None
     for l in lines:
+        num_lines += 1
         if l and not l.startswith("#"):
             sections = l.split(sep)
             d.append(sections)
@@ -551,7 +555,7 @@ def _parse_txt(f, conf):
         return (data, conf)
 
     # Heatmap: Number of headers == number of lines
-    if conf.get("plot_type") is None and first_row_str == len(lines) and all_numeric:
+    if conf.get("plot_type") is None and first_row_str == num_lines and all_numeric:
         conf["plot_type"] = "heatmap"
     if conf.get("plot_type") == "heatmap":
         conf["xcats"] = d[0][1:]
@@ -17,7 +17,7 @@ class DragenCoverageHist(BaseMultiqcModule):
     def add_coverage_hist(self):
         data_by_phenotype_by_sample = defaultdict(dict)
 
-        for f in self.find_log_files("dragen/fine_hist"):
+        for f in self.find_log_files("dragen/fine_hist", filelines=True):
             data_by_phenotype = parse_fine_hist(f)
             if f["s_name"] in data_by_phenotype_by_sample:
                 log.debug("Duplicate sample name found! Overwriting: {}".format(f["s_name"]))
@@ -110,7 +110,7 @@ def parse_fine_hist(f):
 
     # first pass to calculate total number of bases to calculate percentages
     parsed_data = dict()
-    for line in f["f"].splitlines():
+    for line in f["f"]:
         if line.startswith("Depth,Overall"):
             continue
         key, cnt = line.split(",")
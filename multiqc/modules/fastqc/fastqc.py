@@ -23,7 +23,7 @@ import zipfile
 from multiqc import config
 from multiqc.plots import linegraph, bargraph, heatmap
 from multiqc.modules.base_module import BaseMultiqcModule
-from multiqc.utils import report
+from multiqc.utils import archives, report
 
 # Initialise the logger
 log = logging.getLogger(__name__)
@@ -58,7 +58,12 @@ class MultiqcModule(BaseMultiqcModule):
                 log.debug("Skipping '{}' as already parsed '{}'".format(f["fn"], s_name))
                 continue
             try:
-                fqc_zip = zipfile.ZipFile(os.path.join(f["root"], f["fn"]))
+                if "archive" in f:
+                    # Zip file found inside an archive (eg. a tarball of FastQC results), so read it into memory
+                    with archives.open_file(f, "rb") as fh:
+                        fqc_zip = zipfile.ZipFile(io.BytesIO(fh.read()))
+                else:
+                    fqc_zip = zipfile.ZipFile(os.path.join(f["root"], f["fn"]))
             except Exception as e:
                 log.warning("Couldn't read '{}' - Bad zip file".format(f["fn"]))
                 log.debug("Bad zip file error:\n{}".format(e))
@@ -6,12 +6,35 @@
 import logging
 from collections import OrderedDict
 from multiqc import config
+from multiqc.utils import util_functions
 from multiqc.plots import beeswarm, bargraph
 
 # Initialise the logger
 log = logging.getLogger(__name__)
 
 
+def parse_single_report(f):
+    """
+    Parse the summary numbers (SN lines) from a samtools stats log.
+    Returns None if the file can't be read.
+    """
+    # The file is read here rather than in find_log_files(), so skip it if it can't be read
+    try:
+        sn_lines = [line for line in f["f"] if line.startswith("SN")]
+    except util_functions.file_read_errors as e:
+        if config.report_readerrors:
+            log.debug("Couldn't read file when parsing: {}\n{}".format(f["fn"], e))
+        return None
+    parsed_data = dict()
+    for line in sn_lines:
+        sections = line.split("\t")
+        field = sections[1].strip()[:-1]
+        field = field.replace(" ", "_")
+        value = float(sections[2].strip())
+        parsed_data[field] = value
+    return parsed_data
+
+
 class StatsReportMixin:
     """Mixin class, loaded by main samtools MuliqcModule class."""
 
@@ -19,18 +42,9 @@ class StatsReportMixin:
         """Find Samtools stats logs and parse their data"""
 
         self.samtools_stats = dict()
-        for f in self.find_log_files("samtools/stats"):
-            parsed_data = dict()
-            for line in f["f"].splitlines():
-                if not line.startswith("SN"):
-                    continue
-                sections = line.split("\t")
-                field = sections[1].strip()[:-1]
-                field = field.replace(" ", "_")
-                value = float(sections[2].strip())
-                parsed_data[field] = value
-
-            if len(parsed_data) > 0:
+        for f in self.find_log_files("samtools/stats", filehandles=True):
+            parsed_data = self.cached_parse(f, parse_single_report)
+            if parsed_data is not None and len(parsed_data) > 0:
                 # Work out some percentages
                 if "raw_total_sequences" in parsed_data:
                     for k in list(parsed_data.keys()):
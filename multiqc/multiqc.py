@@ -11,14 +11,11 @@ from __future__ import print_function
 
 import base64
 import click
-from distutils import version
-from distutils.dir_util import copy_tree
 import errno
 import io
-import jinja2
 import os
 import re
-import rich
+import rich.console
 import shutil
 import subprocess
 import sys
@@ -26,28 +23,43 @@ import tempfile
 import time
 import traceback
 
-from rich.syntax import Syntax
 
-try:
-    # Python 3 imports
-    from urllib.request import urlopen
-except ImportError:
-    # Python 2 imports
-    from urllib2 import urlopen
-
-    # Use UTF-8 encoding by default
+if sys.version_info[0] < 3:
+    # Python 2: Use UTF-8 encoding by default
     reload(sys)
     sys.setdefaultencoding("utf8")
 
 from .plots import table
-from .utils import report, plugin_hooks, megaqc, util_functions, lint_helpers, config, log, mqc_colour
+from .utils import (
+    archives,
+    memory_profile,
+    parallel_modules,
+    registry,
+    report,
+    result_cache,
+    time_limits,
+    version_check,
+    plugin_hooks,
+    megaqc,
+    util_functions,
+    lint_helpers,
+    config,
+    log,
+    mqc_colour,
+)
 
 start_execution_time = time.time()
 logger = config.logger
 
 
 @click.command(context_settings=dict(help_option_names=["-h", "--help"]))
-@click.argument("analysis_dir", type=click.Path(exists=True), nargs=-1, required=True, metavar="<analysis directory>")
+@click.argument(
+    "analysis_dir",
+    type=click.Path(exists=True, allow_dash=True),
+    nargs=-1,
+    required=True,
+    metavar="<analysis directory>",
+)
 @click.option("-f", "--force", is_flag=True, help="Overwrite any existing reports")
 @click.option("-d", "--dirs", is_flag=True, help="Prepend directory to sample names")
 @click.option(
@@ -113,6 +125,11 @@ logger = config.logger
 @click.option(
     "-l", "--file-list", is_flag=True, help="Supply a file containing a list of file paths to be searched, one per row"
 )
+@click.option(
+    "--manifest",
+    is_flag=True,
+    help="Supply a TSV / JSON lines manifest of files (path, size, search key) instead of directories. Use '-' for stdin",
+)
 @click.option(
     "-e",
     "--exclude",
@@ -175,6 +192,44 @@ logger = config.logger
 @click.option("-v", "--verbose", count=True, default=0, help="Increase output verbosity.")
 @click.option("-q", "--quiet", is_flag=True, help="Only show log warnings")
 @click.option("--profile-runtime", is_flag=True, help="Add analysis of how long MultiQC takes to run to the report")
+@click.option(
+    "--search-workers",
+    "search_workers",
+    type=int,
+    help="Number of threads to use when searching files. Default: {}".format(config.search_workers),
+)
+@click.option(
+    "--walk-workers",
+    "walk_workers",
+    type=int,
+    help="Number of threads to use when listing directories. Default: {}".format(config.walk_workers),
+)
+@click.option(
+    "--search-cache",
+    "search_cache",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Cache file search results in this file, to only search new or changed files next time",
+)
+@click.option(
+    "--parse-cache",
+    "parse_cache",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Cache parsed log file results in this file, to only parse new or changed files next time",
+)
+@click.option(
+    "--module-workers",
+    "module_workers",
+    type=int,
+    metavar="<n>",
+    help="Run modules in this many parallel processes",
+)
+@click.option(
+    "--module-timeout",
+    "module_timeout",
+    type=float,
+    metavar="<seconds>",
+    help="Skip modules that take longer than this to run",
+)
 @click.option("--no-ansi", is_flag=True, help="Disable coloured log output")
 @click.version_option(config.version, prog_name="multiqc")
 def run_cli(
@@ -196,6 +251,7 @@ def run_cli(
     sample_names,
     sample_filters,
     file_list,
+    manifest,
     filename,
     make_data_dir,
     no_data_dir,
@@ -214,6 +270,12 @@ def run_cli(
     verbose,
     quiet,
     profile_runtime,
+    search_workers,
+    walk_workers,
+    search_cache,
+    parse_cache,
+    module_workers,
+    module_timeout,
     no_ansi,
     **kwargs,
 ):
@@ -255,6 +317,7 @@ def run_cli(
         sample_names=sample_names,
         sample_filters=sample_filters,
         file_list=file_list,
+        manifest=manifest,
         filename=filename,
         make_data_dir=make_data_dir,
         no_data_dir=no_data_dir,
@@ -273,6 +336,12 @@ def run_cli(
         verbose=verbose,
         quiet=quiet,
         profile_runtime=profile_runtime,
+        search_workers=search_workers,
+        walk_workers=walk_workers,
+        search_cache=search_cache,
+        parse_cache=parse_cache,
+        module_workers=module_workers,
+        module_timeout=module_timeout,
         no_ansi=no_ansi,
         kwargs=kwargs,
     )
@@ -301,6 +370,7 @@ def run(
     sample_names=None,
     sample_filters=None,
     file_list=False,
+    manifest=False,
     filename=None,
     make_data_dir=False,
     no_data_dir=False,
@@ -319,6 +389,12 @@ def run(
     verbose=0,
     quiet=False,
     profile_runtime=False,
+    search_workers=None,
+    walk_workers=None,
+    search_cache=None,
+    parse_cache=None,
+    module_workers=None,
+    module_timeout=None,
     no_ansi=False,
     kwargs={},
 ):
@@ -349,6 +425,14 @@ def run(
         )
     )
     logger.debug("This is MultiQC v{}".format(config.version))
+    report.runtimes["startup"] = start_execution_time - config.import_start_time
+    logger.debug(
+        "Imported MultiQC in {:.2f}s ({} module registry in {:.3f}s)".format(
+            report.runtimes["startup"],
+            "cached" if registry.load_stats["cached"] else "scanned",
+            registry.load_stats["time"],
+        )
+    )
 
     # Load config files
     plugin_hooks.mqc_trigger("before_config")
@@ -363,19 +447,9 @@ def run(
     report.multiqc_command = " ".join(sys.argv)
     logger.debug("Command used: {}".format(report.multiqc_command))
 
-    # Check that we're running the latest version of MultiQC
-    if config.no_version_check is not True:
-        try:
-            response = urlopen("http://multiqc.info/version.php?v={}".format(config.short_version), timeout=5)
-            remote_version = response.read().decode("utf-8").strip()
-            if version.StrictVersion(re.sub("[^0-9\.]", "", remote_version)) > version.StrictVersion(
-                re.sub("[^0-9\.]", "", config.short_version)
-            ):
-                logger.warning("MultiQC Version {} now available!".format(remote_version))
-            else:
-                logger.debug("Latest MultiQC version is {}".format(remote_version))
-        except Exception as e:
-            logger.debug("Could not connect to multiqc.info for version check: {}".format(e))
+    # Check that we're running the latest version of MultiQC, in the background.
+    # The result is logged when MultiQC finishes
+    version_check.start()
 
     # Set up key variables (overwrite config vars from command line)
     if template is not None:
@@ -438,6 +512,19 @@ def run(
         config.exclude_modules = exclude
     if profile_runtime:
         config.profile_runtime = True
+    memory_profile.start_tracing()
+    if search_workers is not None:
+        config.search_workers = search_workers
+    if walk_workers is not None:
+        config.walk_workers = walk_workers
+    if search_cache is not None:
+        config.search_cache = search_cache
+    if parse_cache is not None:
+        config.parse_cache = parse_cache
+    if module_workers is not None:
+        config.module_workers = module_workers
+    if module_timeout is not None:
+        config.module_timeout = module_timeout
     config.kwargs = kwargs  # Plugin command line options
 
     # Clean up analysis_dir if a string (interactive environment only)
@@ -480,6 +567,20 @@ def run(
             logger.error("Please, check that {} contains correct paths.".format(analysis_dir[0]))
             raise ValueError("Any files or directories to be searched.")
 
+    # Add files from a manifest if --manifest option is given
+    if manifest:
+        if len(analysis_dir) > 1:
+            raise ValueError("If --manifest is given, analysis_dir should have only one manifest file.")
+        config.analysis_dir = []
+        if analysis_dir[0] == "-":
+            num_files = report.load_manifest(sys.stdin)
+        else:
+            with io.open(analysis_dir[0], "r", encoding="utf-8") as in_handle:
+                num_files = report.load_manifest(in_handle)
+        logger.info("Loaded {} files from manifest".format(num_files))
+    elif "-" in config.analysis_dir:
+        raise ValueError("Reading from stdin ('-') is only supported with the --manifest option.")
+
     if len(ignore) > 0:
         logger.debug("Ignoring files, directories and paths that match: {}".format(", ".join(ignore)))
         config.fn_ignore_files.extend(ignore)
@@ -605,25 +706,68 @@ def run(
     # Get the list of files to search
     for d in config.analysis_dir:
         logger.info("Search path : {}".format(os.path.abspath(d)))
+    search_memory = memory_profile.start()
     report.get_filelist(run_module_names)
+    memory_profile.stop(search_memory, "phases", "search")
 
     # Run the modules!
     plugin_hooks.mqc_trigger("before_modules")
     report.modules_output = list()
     sys_exit_code = 0
     total_mods_starttime = time.time()
+    mods_memory = memory_profile.start()
+
+    # Work out which modules found files, so that the others don't need to be imported at all.
+    # Search keys belong to the module that they are named after (same rule as report.get_filelist)
+    mod_files_found = dict()
+    for sp_key, sp_files in report.files.items():
+        mod_name = sp_key.split("/", 1)[0].lower()
+        mod_files_found[mod_name] = mod_files_found.get(mod_name, False) or len(sp_files) > 0
+
+    # Skip modules whose search patterns didn't find anything. Modules without search
+    # patterns and custom content (which can also come from the config) always run.
+    mod_jobs = list()
     for mod_idx, mod_dict in enumerate(run_modules):
+        this_module = list(mod_dict.keys())[0]
+        if this_module != "custom_content" and mod_files_found.get(this_module.lower()) is False:
+            logger.debug("No samples found: {}".format(this_module))
+            continue
+        mod_jobs.append((mod_idx, this_module, list(mod_dict.values())[0] or {}))
+
+    # Run modules in worker processes if requested. Results are still merged in module order below.
+    mod_results = None
+    if config.module_workers is not None and config.module_workers > 1 and len(mod_jobs) > 1:
+        if sys.version_info < (3, 8):
+            logger.warning("Running modules in parallel needs Python 3.8 or later, running them one by one")
+        elif parallel_modules.can_fork():
+            logger.debug("Running modules in {} worker processes".format(config.module_workers))
+            mod_results = parallel_modules.run_modules(mod_jobs, config.module_workers)
+        else:
+            logger.warning("Running modules in parallel is not supported on this system, running them one by one")
+
+    for mod_idx, this_module, mod_cust_config in mod_jobs:
         mod_starttime = time.time()
+        mod_runtime = None
+        mod_memory = memory_profile.start()
+        mod_memory_usage = None
+        # Remember the state of the report, to remove what the module added if it runs out of time
+        mod_snapshot = time_limits.ReportSnapshot() if config.module_timeout else None
         try:
-            this_module = list(mod_dict.keys())[0]
-            mod_cust_config = list(mod_dict.values())[0]
-            if mod_cust_config is None:
-                mod_cust_config = {}
-            mod = config.avail_modules[this_module].load()
-            mod.mod_cust_config = mod_cust_config  # feels bad doing this, but seems to work
-            output = mod()
-            if type(output) != list:
-                output = [output]
+            merged = None
+            if mod_results is not None:
+                merged = parallel_modules.merge_result(next(mod_results), this_module)
+            if merged is not None:
+                output, mod_runtime, mod_memory_usage = merged
+            else:
+                mod = config.avail_modules[this_module].load()
+                mod.mod_cust_config = mod_cust_config  # feels bad doing this, but seems to work
+                time_limits.start()
+                try:
+                    output = mod()
+                finally:
+                    time_limits.stop()
+                if type(output) != list:
+                    output = [output]
             for m in output:
                 report.modules_output.append(m)
 
@@ -653,8 +797,12 @@ def run(
             except AttributeError:
                 pass
 
+        except time_limits.ModuleTimeout as e:
+            time_limits.log_timeout(this_module, e)
+            if mod_snapshot is not None:
+                mod_snapshot.rollback()
         except UserWarning:
-            logger.debug("No samples found: {}".format(list(mod_dict.keys())[0]))
+            logger.debug("No samples found: {}".format(this_module))
         except KeyboardInterrupt:
             shutil.rmtree(tmp_dir)
             logger.critical(
@@ -664,6 +812,9 @@ def run(
             sys.exit(1)
         except:
             # Flag the error, but carry on
+            from rich.panel import Panel
+            from rich.syntax import Syntax
+
             class CustomTraceback:
                 def __rich_console__(self, console: rich.console.Console, options: rich.console.ConsoleOptions):
                     sys_tb = sys.exc_info()
@@ -689,7 +840,7 @@ def run(
 
             console = rich.console.Console(stderr=True, force_terminal=log.force_term_colors())
             console.print(
-                rich.panel.Panel(
+                Panel(
                     CustomTraceback(),
                     title="Oops! The '[underline]{}[/]' MultiQC module broke...".format(this_module),
                     expand=False,
@@ -708,8 +859,16 @@ def run(
             # Exit code 1 for CI failures etc
             sys_exit_code = 1
 
-        report.runtimes["mods"][run_module_names[mod_idx]] = time.time() - mod_starttime
+        result_cache.save()
+        if mod_runtime is None:
+            mod_runtime = time.time() - mod_starttime
+        report.runtimes["mods"][run_module_names[mod_idx]] = mod_runtime
+        memory_profile.stop(mod_memory, "mods", run_module_names[mod_idx], mod_memory_usage)
     report.runtimes["total_mods"] = time.time() - total_mods_starttime
+    memory_profile.stop(mods_memory, "phases", "modules")
+    if mod_results is not None:
+        mod_results.close()
+    archives.close_archives()
 
     # Special-case module if we want to profile the MultiQC running time
     if config.profile_runtime:
@@ -721,6 +880,7 @@ def run(
     if len(report.modules_output) == 0:
         logger.warning("No analysis results found. Cleaning up..")
         shutil.rmtree(tmp_dir)
+        version_check.log_result()
         logger.info("MultiQC complete")
         # Exit with an error code if a module broke
         sys.exit(sys_exit_code)
@@ -811,9 +971,12 @@ def run(
         report.data_sources_tofile()
     # Compress the report plot JSON data
     runtime_compression_start = time.time()
+    compression_memory = memory_profile.start()
     logger.info("Compressing plot data")
     report.plot_compressed_json = report.compress_json(report.plot_data)
     report.runtimes["total_compression"] = time.time() - runtime_compression_start
+    memory_profile.stop(compression_memory, "phases", "compression")
+    template_memory = memory_profile.start()
 
     plugin_hooks.mqc_trigger("before_report_generation")
 
@@ -885,7 +1048,7 @@ def run(
             # Modules have run, so data directory should be complete by now. Move its contents.
             logger.debug("Moving data file from '{}' to '{}'".format(config.data_tmp_dir, config.data_dir))
             # Disable preserving of times and mode on purpose to avoid problems with mounted CIFS shares (see #625)
-            copy_tree(config.data_tmp_dir, config.data_dir, preserve_times=0, preserve_mode=0)
+            util_functions.copy_tree(config.data_tmp_dir, config.data_dir, preserve_metadata=False)
             shutil.rmtree(config.data_tmp_dir)
 
         # Copy across the static plot images if requested
@@ -905,7 +1068,7 @@ def run(
             # Modules have run, so plots directory should be complete by now. Move its contents.
             logger.debug("Moving plots directory from '{}' to '{}'".format(config.plots_tmp_dir, config.plots_dir))
             # Disable preserving of times and mode on purpose to avoid problems with mounted CIFS shares (see #625)
-            copy_tree(config.plots_tmp_dir, config.plots_dir, preserve_times=0, preserve_mode=0)
+            util_functions.copy_tree(config.plots_tmp_dir, config.plots_dir, preserve_metadata=False)
             shutil.rmtree(config.plots_tmp_dir)
 
     plugin_hooks.mqc_trigger("before_template")
@@ -913,12 +1076,12 @@ def run(
     # Load in parent template files first if a child theme
     try:
         parent_template = config.avail_templates[template_mod.template_parent].load()
-        copy_tree(parent_template.template_dir, tmp_dir)
+        util_functions.copy_tree(parent_template.template_dir, tmp_dir)
     except AttributeError:
         pass  # Not a child theme
 
-    # Copy the template files to the tmp directory (distutils overwrites parent theme files)
-    copy_tree(template_mod.template_dir, tmp_dir)
+    # Copy the template files to the tmp directory (overwrites parent theme files)
+    util_functions.copy_tree(template_mod.template_dir, tmp_dir)
 
     # Function to include file contents in Jinja template
     def include_file(name, fdir=tmp_dir, b64=False):
@@ -936,6 +1099,8 @@ def run(
 
     # Load the report template
     try:
+        import jinja2
+
         env = jinja2.Environment(loader=jinja2.FileSystemLoader(tmp_dir))
         env.globals["include_file"] = include_file
         j_template = env.get_template(template_mod.base_fn)
@@ -959,12 +1124,17 @@ def run(
             for f in template_mod.copy_files:
                 fn = os.path.join(tmp_dir, f)
                 dest_dir = os.path.join(os.path.dirname(config.output_fn), f)
-                copy_tree(fn, dest_dir)
+                util_functions.copy_tree(fn, dest_dir)
         except AttributeError:
             pass  # No files to copy
 
     # Clean up temporary directory
     shutil.rmtree(tmp_dir)
+    memory_profile.stop(template_memory, "phases", "template")
+
+    # Save the memory profile with the other data files
+    if config.profile_runtime and config.data_dir is not None and os.path.isdir(config.data_dir):
+        memory_profile.write_json(os.path.join(config.data_dir, "multiqc_runtime_memory.json"))
 
     # Zip the data directory if requested
     if config.zip_data_dir and config.data_dir is not None:
@@ -1012,10 +1182,16 @@ def run(
 
     plugin_hooks.mqc_trigger("execution_finish")
 
+    version_check.log_result()
     logger.info("MultiQC complete")
     report.runtimes["total"] = time.time() - start_execution_time
     if config.profile_runtime:
         logger.info("Run took {:.2f} seconds".format(report.runtimes["total"]))
+        logger.info(
+            " - {:.2f}s: Starting up (module registry {})".format(
+                report.runtimes["startup"], "cached" if registry.load_stats["cached"] else "scanned"
+            )
+        )
         logger.info(" - {:.2f}s: Searching files".format(report.runtimes["total_sp"]))
         logger.info(" - {:.2f}s: Running modules".format(report.runtimes["total_mods"]))
         logger.info(" - {:.2f}s: Compressing report data".format(report.runtimes["total_compression"]))
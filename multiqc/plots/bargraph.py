@@ -12,27 +12,12 @@ import math
 import os
 import random
 import re
-import sys
 
+from multiqc.plots.mpl import import_matplotlib
 from multiqc.utils import config, report, util_functions
 
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-
-    logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 # Load the template so that we can access its configuration
@@ -304,6 +289,8 @@ def matplotlib_bargraph(plotdata, plotsamples, pconfig=None):
     plot_bargraph, which properly formats the input data.
     """
 
+    plt = import_matplotlib()
+
     if pconfig is None:
         pconfig = {}
 
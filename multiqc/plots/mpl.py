@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+""" MultiQC MatPlotLib loading, shared by the plot types that make flat plots.
+MatPlotLib is slow to import, so it's only imported when the first flat plot is made. """
+
+from __future__ import print_function
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+plt = None
+mpl_import_error = None
+
+
+def import_matplotlib():
+    """
+    Import MatPlotLib, if it hasn't been imported yet, and return matplotlib.pyplot.
+    Raises an ImportError if it can't be loaded.
+    """
+    global plt, mpl_import_error
+    if plt is None and mpl_import_error is None:
+        try:
+            # Import matplot lib but avoid default X environment
+            import matplotlib
+
+            matplotlib.use("Agg")
+            import matplotlib.pyplot
+
+            plt = matplotlib.pyplot
+            logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
+        except Exception as e:
+            # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
+            # The lack of the library will be handled by the callers, which fall back to interactive plots
+            print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
+            print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
+            print(e)
+            mpl_import_error = e
+    if mpl_import_error is not None:
+        raise ImportError("MatPlotLib could not be loaded: {}".format(mpl_import_error))
+    return plt
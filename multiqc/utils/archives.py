@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+""" MultiQC archive search. Reads log files from inside tar and zip
+archives without extracting them to disk. Files found inside archives
+look like they are in a directory with the same name as the archive. """
+
+from __future__ import print_function
+import logging
+import os
+import posixpath
+import sys
+import tarfile
+import threading
+import zipfile
+
+from multiqc.utils import util_functions
+
+logger = logging.getLogger(__name__)
+
+archive_exts = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz", ".zip")
+
+# The archive most recently opened by open_file(), kept open for the next file
+_open_archive = None
+_open_archive_lock = threading.Lock()
+
+
+def is_archive(fn):
+    """Does this filename have a tar or zip archive file extension?"""
+    return fn.lower().endswith(archive_exts)
+
+
+class Archive(object):
+    """
+    A tar or zip archive opened for reading. Files inside the archive can be
+    read one after another in a single pass, so that compressed tarballs are
+    only decompressed once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = None
+        self._tar = None
+        self._tar_members = dict()
+        if path.lower().endswith(".zip"):
+            self._zip = zipfile.ZipFile(path)
+        else:
+            self._tar = tarfile.open(path, "r:*")
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        if self._tar is not None:
+            self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def members(self):
+        """Yields the name and size of each regular file in the archive, in archive order"""
+        if self._zip is not None:
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    yield info.filename, info.file_size
+        else:
+            for member in self._tar:
+                if member.isfile():
+                    self._tar_members[member.name] = member
+                    yield member.name, member.size
+
+    def open(self, name, mode="r", encoding="utf-8"):
+        """
+        Open a file in the archive for reading. Contents are streamed, not extracted.
+        Compressed files inside the archive are decompressed if config.decompress_logs is set.
+        """
+        if self._zip is not None:
+            fh = self._zip.open(name)
+        else:
+            fh = self._tar.extractfile(self._tar_members.get(name) or self._tar.getmember(name))
+        return util_functions.open_file(name, mode, encoding, fileobj=fh)
+
+
+def member_path(archive_path, name):
+    """
+    The virtual path of a file inside an archive, split into (root, fn)
+    like a file found on disk. eg. ('run1.tar.gz/logs', 'sample.log')
+    """
+    name = posixpath.normpath("/" + name).lstrip("/")
+    dirname, fn = posixpath.split(name)
+    root = os.path.join(archive_path, *dirname.split("/")) if dirname else archive_path
+    # Intern directory names, so that files in the same directory share one string
+    return sys.intern(root), fn
+
+
+def open_file(f, mode="r", encoding="utf-8"):
+    """
+    Open a file found by the file search, which may be inside an archive.
+    The last archive opened is kept open, as modules usually read several
+    files from the same archive in order. Call close_archives() when done.
+    :param f: File dict from report.files, with 'archive' and 'archive_member' keys for files in archives
+    """
+    global _open_archive
+    if "archive" not in f:
+        return util_functions.open_file(os.path.join(f["root"], f["fn"]), mode, encoding)
+    with _open_archive_lock:
+        if _open_archive is None or _open_archive.path != f["archive"]:
+            if _open_archive is not None:
+                _open_archive.close()
+            _open_archive = Archive(f["archive"])
+        return _open_archive.open(f["archive_member"], mode, encoding)
+
+
+def close_archives():
+    """Close the archive kept open by open_file(), if any"""
+    global _open_archive
+    with _open_archive_lock:
+        if _open_archive is not None:
+            _open_archive.close()
+            _open_archive = None
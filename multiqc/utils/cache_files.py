@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+""" MultiQC cache files. Where MultiQC keeps its caches in the user cache directory,
+and how they are written so that MultiQC runs sharing a cache never read half a file.
+Only uses the standard library, as it's needed before the config has been loaded. """
+
+from __future__ import print_function
+import os
+import tempfile
+
+
+def cache_path(*names):
+    """Path in the MultiQC user cache directory: $XDG_CACHE_HOME/multiqc, or ~/.cache/multiqc"""
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "multiqc", *names)
+
+
+def write_atomic(path, write, binary=False):
+    """
+    Write a file by calling write() with a temporary file in the same directory, then moving
+    the temporary file into place. Creates the directory if needed. Errors are raised as usual,
+    and the temporary file is removed.
+    """
+    dir_name = os.path.dirname(path) or "."
+    os.makedirs(dir_name, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".{}.".format(os.path.basename(path)))
+    try:
+        with os.fdopen(fd, "wb" if binary else "w") as fh:
+            write(fh)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -8,12 +8,16 @@ from datetime import datetime
 import inspect
 import collections
 import os
-import pkg_resources
 import subprocess
 import sys
+import time
 import yaml
 
 import multiqc
+from multiqc.utils import registry, yaml_cache
+
+# When MultiQC started being imported, to report the start up time
+import_start_time = time.time()
 
 # Default logger will be replaced by caller
 import logging
@@ -21,8 +25,8 @@ import logging
 logger = logging.getLogger("multiqc")
 
 # Get the MultiQC version
-version = pkg_resources.get_distribution("multiqc").version
-short_version = pkg_resources.get_distribution("multiqc").version
+version = registry.version("multiqc")
+short_version = registry.version("multiqc")
 script_path = os.path.dirname(os.path.realpath(__file__))
 git_hash = None
 git_hash_short = None
@@ -41,14 +45,12 @@ MULTIQC_DIR = os.path.dirname(os.path.realpath(inspect.getfile(multiqc)))
 ##### MultiQC Defaults
 # Default MultiQC config
 searchp_fn = os.path.join(MULTIQC_DIR, "utils", "config_defaults.yaml")
-with open(searchp_fn) as f:
-    configs = yaml.safe_load(f)
-    for c, v in configs.items():
-        globals()[c] = v
+configs = yaml_cache.load_file(searchp_fn)
+for c, v in configs.items():
+    globals()[c] = v
 # Module filename search patterns
 searchp_fn = os.path.join(MULTIQC_DIR, "utils", "search_patterns.yaml")
-with open(searchp_fn) as f:
-    sp = yaml.safe_load(f)
+sp = yaml_cache.load_file(searchp_fn)
 
 # Other defaults that can't be set in YAML
 data_tmp_dir = "/tmp"  # will be overwritten by core script
@@ -63,17 +65,15 @@ megaqc_access_token = os.environ.get("MEGAQC_ACCESS_TOKEN")
 # Modules must be listed in setup.py under entry_points['multiqc.modules.v1']
 # Get all modules, including those from other extension packages
 avail_modules = dict()
-for entry_point in pkg_resources.iter_entry_points("multiqc.modules.v1"):
-    nicename = str(entry_point).split("=")[0].strip()
-    avail_modules[nicename] = entry_point
+for entry_point in registry.entry_points("multiqc.modules.v1"):
+    avail_modules[entry_point.name] = entry_point
 
 ##### Available templates
 # Templates must be listed in setup.py under entry_points['multiqc.templates.v1']
 # Get all templates, including those from other extension packages
 avail_templates = {}
-for entry_point in pkg_resources.iter_entry_points("multiqc.templates.v1"):
-    nicename = str(entry_point).split("=")[0].strip()
-    avail_templates[nicename] = entry_point
+for entry_point in registry.entry_points("multiqc.templates.v1"):
+    avail_templates[entry_point.name] = entry_point
 
 ##### Check we have modules & templates
 # Check that we were able to find some modules and templates
@@ -123,13 +123,12 @@ def mqc_load_config(yaml_config):
 
     if os.path.isfile(yaml_config):
         try:
-            with open(yaml_config) as f:
-                new_config = yaml.safe_load(f)
-                logger.debug("Loading config settings from: {}".format(yaml_config))
-                mqc_add_config(new_config, yaml_config)
+            new_config = yaml_cache.load_file(yaml_config)
+            logger.debug("Loading config settings from: {}".format(yaml_config))
+            mqc_add_config(new_config, yaml_config)
         except (IOError, AttributeError) as e:
             logger.debug("Config error: {}".format(e))
-        except yaml.scanner.ScannerError as e:
+        except yaml.YAMLError as e:
             logger.error("Error parsing config YAML: {}".format(e))
             sys.exit(1)
     else:
@@ -139,13 +138,13 @@ def mqc_load_config(yaml_config):
 def mqc_cl_config(cl_config):
     for clc_str in cl_config:
         try:
-            parsed_clc = yaml.safe_load(clc_str)
+            parsed_clc = yaml_cache.safe_load(clc_str)
             # something:var fails as it needs a space. Fix this (a common mistake)
             if isinstance(parsed_clc, str) and ":" in clc_str:
                 clc_str = ": ".join(clc_str.split(":"))
-                parsed_clc = yaml.safe_load(clc_str)
+                parsed_clc = yaml_cache.safe_load(clc_str)
             assert isinstance(parsed_clc, dict)
-        except yaml.scanner.ScannerError as e:
+        except yaml.YAMLError as e:
             logger.error("Could not parse command line config: {}\n{}".format(clc_str, e))
         except AssertionError:
             logger.error("Could not parse command line config: {}".format(clc_str))
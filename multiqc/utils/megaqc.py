@@ -7,7 +7,6 @@ import gzip
 import io
 import json
 import os
-import requests
 
 from multiqc import config
 
@@ -71,6 +70,9 @@ def multiqc_dump_json(report):
 
 
 def multiqc_api_post(exported_data):
+    # Imported here, as it's slow to import and only needed when uploading to MegaQC
+    import requests
+
     headers = {"Content-Type": "application/json", "content-encoding": "gzip"}
     if config.megaqc_access_token is not None:
         headers["access_token"] = config.megaqc_access_token
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+""" MultiQC memory profiling, for --profile-runtime. Records the peak resident
+set size (RSS) and the Python memory allocations of each phase of the run and
+of each module, in report.memory_usage. """
+
+from __future__ import print_function
+import io
+import json
+import logging
+import os
+import sys
+import tracemalloc
+
+from multiqc.utils import config, report
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Measurements that have been started but not stopped, outermost first
+_active = list()
+
+
+def start_tracing():
+    """Start tracing Python memory allocations, if config.profile_runtime_tracemalloc is set"""
+    if config.profile_runtime and config.profile_runtime_tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def _current_rss():
+    """Current resident set size in bytes, or None if it isn't available (Linux only)"""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss():
+    """Peak resident set size in bytes, since the last _reset_peak_rss() if that worked"""
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS and in kilobytes elsewhere
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS to the current RSS, so that the peak of each phase can be measured (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        pass
+
+
+class Measurement(object):
+    """
+    Memory use from when the measurement is created until stop() is called.
+    Measurements can be nested (eg. each module inside the modules phase),
+    in which case the peaks of the inner measurements count towards the outer ones.
+    """
+
+    def __init__(self):
+        self.peak_rss = None
+        self.peak_alloc = None
+        self._propagate_peaks()
+        _reset_peak_rss()
+        self.start_rss = _current_rss()
+        self.start_alloc = None
+        if tracemalloc.is_tracing():
+            # Python 3.9+, otherwise the peak is since tracing started
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            self.start_alloc = tracemalloc.get_traced_memory()[0]
+        _active.append(self)
+
+    def _update_peaks(self, peak_rss, peak_alloc):
+        if peak_rss is not None and (self.peak_rss is None or peak_rss > self.peak_rss):
+            self.peak_rss = peak_rss
+        if peak_alloc is not None and (self.peak_alloc is None or peak_alloc > self.peak_alloc):
+            self.peak_alloc = peak_alloc
+
+    def _propagate_peaks(self):
+        """Pass the peaks so far to the running measurements, before the peak counters are reset"""
+        peak_rss = _peak_rss()
+        peak_alloc = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        for measurement in _active:
+            measurement._update_peaks(peak_rss, peak_alloc)
+
+    def stop(self):
+        """
+        Stop measuring. Returns a dict with the peak RSS, the change in RSS, the peak
+        Python allocations and the change in Python allocations, in bytes.
+        Values that can't be measured on this system are None.
+        """
+        self._propagate_peaks()
+        if self in _active:
+            _active.remove(self)
+        end_rss = _current_rss()
+        usage = {
+            "peak_rss": self.peak_rss,
+            "rss_delta": end_rss - self.start_rss if end_rss is not None and self.start_rss is not None else None,
+            "peak_alloc": None,
+            "alloc_delta": None,
+        }
+        if self.start_alloc is not None and tracemalloc.is_tracing():
+            usage["peak_alloc"] = self.peak_alloc - self.start_alloc
+            usage["alloc_delta"] = tracemalloc.get_traced_memory()[0] - self.start_alloc
+        return usage
+
+
+def start():
+    """Start a measurement if --profile-runtime is being used, otherwise returns None"""
+    if not config.profile_runtime:
+        return None
+    return Measurement()
+
+
+def stop(measurement, section, name, usage=None):
+    """
+    Record the memory used since start() in report.memory_usage[section][name].
+    :param usage: Memory use measured elsewhere (eg. in a worker process) to record instead
+    """
+    if measurement is not None:
+        measured = measurement.stop()
+        report.memory_usage[section][name] = usage if usage is not None else measured
+
+
+def write_json(path):
+    """Write the memory use and run times of each phase and module to a JSON file"""
+    data = {
+        "phases": report.memory_usage["phases"],
+        "mods": report.memory_usage["mods"],
+        "runtimes": {
+            "startup": report.runtimes["startup"],
+            "search": report.runtimes["total_sp"],
+            "modules": report.runtimes["total_mods"],
+            "compression": report.runtimes["total_compression"],
+            "mods": report.runtimes["mods"],
+        },
+        "tracemalloc": tracemalloc.is_tracing(),
+    }
+    try:
+        with io.open(path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, indent=4)
+    except IOError as e:
+        logger.warning("Could not write memory profile to '{}': {}".format(path, e))
@@ -4,8 +4,6 @@ Helper functions to manipulate colours and colour scales
 """
 
 from __future__ import print_function
-import spectra
-import numpy as np
 import os
 import re
 
@@ -14,12 +12,29 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# numpy and spectra are slow to import and not needed until a table is made,
+# so they're imported when the first colour scale is created
+np = None
+spectra = None
+
+
+def import_colour_libs():
+    """Import numpy and spectra, if they haven't been imported yet"""
+    global np, spectra
+    if spectra is None:
+        import numpy
+        import spectra as spectra_lib
+
+        np = numpy
+        spectra = spectra_lib
+
 
 class mqc_colour_scale(object):
     """Class to hold a colour scheme."""
 
     def __init__(self, name="GnBu", minval=0, maxval=100):
         """Initialise class with a colour scale"""
+        import_colour_libs()
 
         self.colours = self.get_colours(name)
         self.name = name
@@ -43,7 +58,6 @@ class mqc_colour_scale(object):
 
     def get_colour(self, val, colformat="hex", lighten=0.3):
         """Given a value, return a colour within the colour scale"""
-
         # Ported from the original JavaScript for continuity
         # Seems to work better than adjusting brightness / saturation / luminosity
         rgb_converter = lambda x: max(0, min(1, 1 + ((x - 1) * lighten)))
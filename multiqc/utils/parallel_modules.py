@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+
+""" MultiQC parallel module execution. Runs modules in forked worker processes
+and merges what each one added to the report back into the main process in
+module order, so that the report is the same as running them one by one. """
+
+from __future__ import print_function
+import copy
+import importlib
+import io
+import logging
+import marshal
+import multiprocessing
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+import types
+
+from multiqc.utils import archives, config, memory_profile, report, result_cache, time_limits
+
+logger = logging.getLogger(__name__)
+
+# State of the main process before the modules were run, copied when the workers start
+_worker_state = dict()
+
+
+def can_fork():
+    """Parallel module execution relies on forked processes inheriting the search results"""
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+class ModulePickler(pickle.Pickler):
+    """
+    Pickler that can also send lambdas and nested functions back from the workers,
+    such as the 'modify' functions in general statistics table headers.
+    These are rebuilt from their code object in the main process.
+    Needs Python 3.8 or later (reducer_override and types.CellType).
+    """
+
+    def reducer_override(self, obj):
+        if isinstance(obj, types.FunctionType) and ("<lambda>" in obj.__qualname__ or "<locals>" in obj.__qualname__):
+            closure = None
+            if obj.__closure__ is not None:
+                closure = tuple(cell.cell_contents for cell in obj.__closure__)
+            return (
+                _make_function,
+                (marshal.dumps(obj.__code__), obj.__module__, obj.__name__, obj.__defaults__, closure),
+            )
+        return NotImplemented
+
+
+def _make_function(code, module_name, name, defaults, closure):
+    """Rebuild a function pickled by ModulePickler, with the globals of the module that defined it"""
+    module_globals = importlib.import_module(module_name).__dict__ if module_name else dict()
+    cells = None
+    if closure is not None:
+        cells = tuple(types.CellType(value) for value in closure)
+    return types.FunctionType(marshal.loads(code), module_globals, name, defaults, cells)
+
+
+def dumps(obj):
+    fh = io.BytesIO()
+    ModulePickler(fh, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return fh.getvalue()
+
+
+def _config_snapshot():
+    """Pickle each config variable holding data, to find the ones that a module changes"""
+    snapshot = dict()
+    for key, value in vars(config).items():
+        if key.startswith("__") or isinstance(value, (types.ModuleType, types.FunctionType, type, logging.Logger)):
+            continue
+        try:
+            snapshot[key] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            pass
+    return snapshot
+
+
+def _flat_data_sources():
+    return {
+        (mod, section, s_name): source
+        for mod, sections in report.data_sources.items()
+        for section, sources in sections.items()
+        for s_name, source in sources.items()
+    }
+
+
+def _init_worker():
+    """Remember the state of the report and config before any modules have run"""
+    # Don't share the file position of an archive left open by the parent process
+    archives.close_archives()
+    _worker_state["report"] = {
+        name: copy.deepcopy(getattr(report, name))
+        for name in report.module_report_lists + report.module_report_dicts + report.module_report_counts
+    }
+    _worker_state["data_sources"] = _flat_data_sources()
+    _worker_state["config"] = _config_snapshot()
+
+
+def _reset_worker():
+    """Put the report and config back to how they were before any modules ran"""
+    for name, value in _worker_state["report"].items():
+        setattr(report, name, copy.deepcopy(value))
+    report.data_sources.clear()
+    for (mod, section, s_name), source in _worker_state["data_sources"].items():
+        report.data_sources[mod][section][s_name] = source
+    for key, value in _config_snapshot().items():
+        if key not in _worker_state["config"]:
+            delattr(config, key)
+        elif value != _worker_state["config"][key]:
+            setattr(config, key, pickle.loads(_worker_state["config"][key]))
+
+
+def _pickle_module_output(mod):
+    """
+    Keep the attributes of a module object that can be sent back to the main process.
+    Other attributes (eg. open file handles left over from parsing) are dropped, but
+    the ones used to build the report must be there.
+    """
+    attrs = dict()
+    for key, value in vars(mod).items():
+        try:
+            dumps(value)
+        except Exception:
+            if key in ("name", "anchor", "sections", "intro", "comment", "css", "js"):
+                raise
+            continue
+        attrs[key] = value
+    return type(mod), attrs
+
+
+def _run_module(job):
+    """
+    Run a single module in a worker process. Returns the pickled module output and
+    everything that it added to the report, or None if the module should be run
+    again in the main process instead (eg. it crashed, so that the error is reported as usual).
+    Modules that go over config.module_timeout are not run again.
+    """
+    mod_idx, mod_name, mod_cust_config = job
+    _reset_worker()
+    # Workers would otherwise all make the same 'random' plot IDs
+    random.seed()
+    # Write data files and plots to a directory for this module, to be moved once merged
+    dirs = dict()
+    for dir_key in ("data_dir", "plots_dir"):
+        if getattr(config, dir_key, None) is not None:
+            dirs[dir_key] = (getattr(config, dir_key), tempfile.mkdtemp(prefix="mqc_module_{}_".format(mod_idx)))
+            setattr(config, dir_key, dirs[dir_key][1])
+
+    start = time.time()
+    memory = memory_profile.start()
+    no_samples = False
+    try:
+        mod = config.avail_modules[mod_name].load()
+        mod.mod_cust_config = mod_cust_config
+        time_limits.start()
+        try:
+            output = mod()
+        finally:
+            time_limits.stop()
+        if type(output) != list:
+            output = [output]
+    except UserWarning:
+        output = []
+        no_samples = True
+    except time_limits.ModuleTimeout as e:
+        _discard_dirs(dirs)
+        return dumps({"timeout": True, "last_found_file": e.last_found_file})
+    except Exception:
+        logger.debug("Module '{}' failed in worker process, will run it again".format(mod_name), exc_info=True)
+        _discard_dirs(dirs)
+        return None
+    runtime = time.time() - start
+    memory_usage = memory.stop() if memory is not None else None
+    result_cache.save()
+
+    try:
+        init = _worker_state["report"]
+        data_sources = _flat_data_sources()
+        result = {
+            "output": [_pickle_module_output(m) for m in output],
+            "no_samples": no_samples,
+            "runtime": runtime,
+            "memory_usage": memory_usage,
+            "lists": {name: getattr(report, name)[len(init[name]) :] for name in report.module_report_lists},
+            "dicts": {
+                name: {k: v for k, v in getattr(report, name).items() if k not in init[name]}
+                for name in report.module_report_dicts
+            },
+            "counts": {name: getattr(report, name) - init[name] for name in report.module_report_counts},
+            "data_sources": {k: v for k, v in data_sources.items() if _worker_state["data_sources"].get(k, None) != v},
+            "config": {
+                key: value
+                for key, value in _config_snapshot().items()
+                if key not in ("data_dir", "plots_dir") and _worker_state["config"].get(key) != value
+            },
+            "dirs": {dir_key: dirs[dir_key][1] for dir_key in dirs},
+        }
+        return dumps(result)
+    except Exception:
+        logger.debug("Could not send results of module '{}' from worker process".format(mod_name), exc_info=True)
+        _discard_dirs(dirs)
+        return None
+    finally:
+        for dir_key, (orig_dir, _) in dirs.items():
+            setattr(config, dir_key, orig_dir)
+
+
+def _discard_dirs(dirs):
+    """Remove the worker's output directories for a module and go back to the usual ones"""
+    for dir_key, (orig_dir, worker_dir) in dirs.items():
+        setattr(config, dir_key, orig_dir)
+        shutil.rmtree(worker_dir, ignore_errors=True)
+
+
+def run_modules(jobs, workers):
+    """
+    Start running modules in a pool of forked worker processes.
+    :param jobs: List of (module index, module name, module custom config) to run
+    Yields the result for each job in order, to be passed to merge_result().
+    The pool is started when the first result is asked for.
+    """
+    # Import the plotting modules once here, rather than in every worker. MatPlotLib is
+    # otherwise only imported when needed, but is likely to be needed by some of the workers
+    for plot_module in ("bargraph", "linegraph"):
+        importlib.import_module("multiqc.plots.{}".format(plot_module))
+    if not config.plots_force_interactive:
+        try:
+            importlib.import_module("multiqc.plots.mpl").import_matplotlib()
+        except ImportError:
+            pass
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(processes=workers, initializer=_init_worker) as pool:
+        for result in pool.imap(_run_module, jobs):
+            yield result
+
+
+def _collisions(result):
+    """
+    Check whether anything the module made clashes with what earlier modules made.
+    The worker didn't know about these, so it would have named things differently.
+    """
+    if set(result["lists"]["html_ids"]) & set(report.html_ids):
+        return "HTML IDs"
+    for name in report.module_report_dicts:
+        if set(result["dicts"][name]) & set(getattr(report, name)):
+            return name
+    for dir_key, worker_dir in result["dirs"].items():
+        for root, _, fns in os.walk(worker_dir):
+            for fn in fns:
+                dest = os.path.join(getattr(config, dir_key), os.path.relpath(os.path.join(root, fn), worker_dir))
+                if os.path.exists(dest):
+                    return "{} file {}".format(dir_key, fn)
+    return None
+
+
+def _remove_dirs(result):
+    for worker_dir in result["dirs"].values():
+        shutil.rmtree(worker_dir, ignore_errors=True)
+
+
+def merge_result(pickled_result, mod_name):
+    """
+    Add the report contributions of a module run in a worker process to the report.
+    Returns a tuple of the list of module output objects, the module run time and
+    memory use (if profiling) measured in the worker, or None if the module needs to be run again in the main process.
+    Raises UserWarning if the module found no samples, like the module itself,
+    or ModuleTimeout if it went over config.module_timeout.
+    """
+    if pickled_result is None:
+        return None
+    result = pickle.loads(pickled_result)
+    if result.get("timeout"):
+        raise time_limits.ModuleTimeout(result["last_found_file"])
+    clash = _collisions(result)
+    if clash is not None:
+        logger.debug("Running module '{}' again, as its {} clashed with earlier modules".format(mod_name, clash))
+        _remove_dirs(result)
+        return None
+
+    for name, values in result["lists"].items():
+        getattr(report, name).extend(values)
+    for name, values in result["dicts"].items():
+        getattr(report, name).update(values)
+    for name, value in result["counts"].items():
+        setattr(report, name, getattr(report, name) + value)
+    for (mod, section, s_name), source in result["data_sources"].items():
+        report.data_sources[mod][section][s_name] = source
+    for key, value in result["config"].items():
+        setattr(config, key, pickle.loads(value))
+    for dir_key, worker_dir in result["dirs"].items():
+        for root, _, fns in os.walk(worker_dir):
+            dest_dir = os.path.join(getattr(config, dir_key), os.path.relpath(root, worker_dir))
+            for fn in fns:
+                if not os.path.isdir(dest_dir):
+                    os.makedirs(dest_dir)
+                shutil.move(os.path.join(root, fn), os.path.join(dest_dir, fn))
+    _remove_dirs(result)
+
+    if result["no_samples"]:
+        raise UserWarning
+    output = list()
+    for mod_class, attrs in result["output"]:
+        mod = mod_class.__new__(mod_class)
+        mod.__dict__.update(attrs)
+        output.append(mod)
+    return output, result["runtime"], result["memory_usage"]
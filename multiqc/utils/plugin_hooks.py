@@ -4,16 +4,15 @@
 to run their own custom subroutines at predefined
 trigger points during MultiQC execution. """
 
-import pkg_resources
+from multiqc.utils import registry
 
 # Load the hooks
 hook_functions = {}
-for entry_point in pkg_resources.iter_entry_points("multiqc.hooks.v1"):
-    nicename = str(entry_point).split("=")[0].strip()
+for entry_point in registry.entry_points("multiqc.hooks.v1"):
     try:
-        hook_functions[nicename].append(entry_point.load())
+        hook_functions[entry_point.name].append(entry_point.load())
     except KeyError:
-        hook_functions[nicename] = [entry_point.load()]
+        hook_functions[entry_point.name] = [entry_point.load()]
 
 # Function to run the hooks
 def mqc_trigger(trigger):
@@ -7,8 +7,8 @@ from collections import OrderedDict
 import logging
 import re
 
-from multiqc.utils import report
-from multiqc.plots import bargraph
+from multiqc.utils import config, report
+from multiqc.plots import bargraph, table
 from multiqc.modules.base_module import BaseMultiqcModule
 
 # Initialise the logger
@@ -37,6 +37,10 @@ class MultiqcModule(BaseMultiqcModule):
 
         self.search_pattern_times_section()
 
+        self.search_pattern_io_section()
+
+        self.memory_usage_section()
+
     def file_search_stats_section(self):
         """Count of all files iterated through by MultiQC, by category"""
 
@@ -79,6 +83,7 @@ class MultiqcModule(BaseMultiqcModule):
                 * `Skipped: Filesize limit` - File was skipped because it was too large (see `config.log_filesize_limit`)
                 * `Skipped: Symlinks` - File was a symlink and skipped (see `config.ignore_symlinks`)
                 * `Skipped: Not a file` - File could not be read (eg. was a unix pipe or something)
+                * `Skipped: Duplicate` - File was another path to a file that was already found (see `config.dedupe_files`)
             """,
             plot=bargraph.plot(pdata, pcats, pconfig),
         )
@@ -125,3 +130,213 @@ class MultiqcModule(BaseMultiqcModule):
             """,
             plot=bargraph.plot(pdata, None, pconfig),
         )
+
+    def search_pattern_io_section(self):
+        """Section with a table and bar plot of the file reads made by each search pattern"""
+
+        if len(report.search_io_stats) == 0:
+            return
+
+        tdata = OrderedDict()
+        for key in sorted(report.search_io_stats, key=lambda k: report.search_io_stats[k]["bytes_read"], reverse=True):
+            key_stats = report.search_io_stats[key]
+            tdata[key] = {
+                "files_tested": key_stats["files_tested"],
+                "files_matched": key_stats["files_matched"],
+                "match_rate": (key_stats["files_matched"] / key_stats["files_tested"]) * 100.0
+                if key_stats["files_tested"] > 0
+                else 0,
+                "files_opened": key_stats["files_opened"],
+                "bytes_read": key_stats["bytes_read"],
+                "lines_read": key_stats["lines_read"],
+                "lines_scanned": key_stats["lines_scanned"],
+                "decode_errors": key_stats["decode_errors"],
+                "time": key_stats["time"],
+            }
+
+        # Write to a data file
+        self.write_data_file(tdata, "multiqc_runtime_search_io")
+
+        headers = OrderedDict()
+        headers["files_tested"] = {
+            "title": "Files tested",
+            "description": "Number of files tested against this search key (after filename indexing)",
+            "format": "{:,.0f}",
+            "scale": "Blues",
+        }
+        headers["files_matched"] = {
+            "title": "Files matched",
+            "description": "Number of files that matched this search key",
+            "format": "{:,.0f}",
+            "scale": "Greens",
+        }
+        headers["match_rate"] = {
+            "title": "Match rate",
+            "description": "Percentage of tested files that matched",
+            "suffix": "%",
+            "min": 0,
+            "max": 100,
+            "scale": "RdYlGn",
+        }
+        headers["files_opened"] = {
+            "title": "Files opened",
+            "description": "Number of files opened to search their contents for this search key",
+            "format": "{:,.0f}",
+            "scale": "OrRd",
+        }
+        headers["bytes_read"] = {
+            "title": "Bytes read",
+            "description": "Amount of file contents read for this search key (decoded characters)",
+            "format": "{:,.0f}",
+            "scale": "OrRd",
+        }
+        headers["lines_read"] = {
+            "title": "Lines read",
+            "description": "Number of lines read from files for this search key",
+            "format": "{:,.0f}",
+            "scale": "OrRd",
+        }
+        headers["lines_scanned"] = {
+            "title": "Lines scanned",
+            "description": "Number of lines tested by this search key's contents patterns",
+            "format": "{:,.0f}",
+            "scale": "OrRd",
+        }
+        headers["decode_errors"] = {
+            "title": "Decode errors",
+            "description": "Number of files that could not be decoded as text (UTF-8)",
+            "format": "{:,.0f}",
+            "scale": "Reds",
+        }
+
+        pconfig = {
+            "id": "multiqc_runtime_search_io_table",
+            "table_title": "MultiQC: File reads per search pattern key",
+            "col1_header": "Search key",
+            "no_beeswarm": True,
+        }
+
+        pdata = [OrderedDict(), OrderedDict()]
+        for key, key_stats in tdata.items():
+            pdata[0][key] = {"bytes_read": key_stats["bytes_read"]}
+            pdata[1][key] = {"lines_scanned": key_stats["lines_scanned"]}
+        bconfig = {
+            "id": "multiqc_runtime_search_io_plot",
+            "title": "MultiQC: File reads per search pattern key",
+            "use_legend": False,
+            "cpswitch": False,
+            "data_labels": [
+                {"name": "Bytes read", "ylab": "Bytes read"},
+                {"name": "Lines scanned", "ylab": "Lines scanned"},
+            ],
+        }
+
+        self.add_section(
+            name="Search pattern file reads",
+            anchor="multiqc_runtime_search_io",
+            description="""
+                Files opened and read by each search pattern key while looking for files.
+                Files found in the search cache are not read, so are not counted here.
+            """,
+            helptext="""
+                File contents are only read once per file and shared between search patterns.
+                Reads are counted against the search key that first needed them - eg. a pattern
+                with a large `num_lines` will be charged for reading lines that other patterns then reuse.
+
+                * `Files tested` - Files that were tested against this search key, after ruling out
+                  files whose names can't match
+                * `Match rate` - Percentage of tested files that matched. A low match rate with a lot
+                  of bytes read suggests that the pattern would benefit from `fn`, `num_lines` or `max_filesize`
+                * `Bytes read` / `Lines read` - File contents read from disk for this search key
+                * `Lines scanned` - Lines tested by the `contents` / `contents_re` patterns
+                * `Decode errors` - Files that couldn't be read as text, eg. binary files
+            """,
+            plot=table.plot(tdata, headers, pconfig) + bargraph.plot(pdata, None, bconfig),
+        )
+
+    def memory_usage_section(self):
+        """Section with a table of the memory used by each phase of the run and each module"""
+
+        phase_names = {"search": "File search", "modules": "Running modules"}
+        tdata = OrderedDict()
+        for key, name in phase_names.items():
+            if key in report.memory_usage["phases"]:
+                tdata["Phase: {}".format(name)] = report.memory_usage["phases"][key]
+        for mod_name, usage in report.memory_usage["mods"].items():
+            tdata["Module: {}".format(mod_name)] = usage
+        if len(tdata) == 0:
+            return
+
+        mb = 1024 * 1024
+        for row_name in tdata:
+            tdata[row_name] = {k: v / mb if v is not None else None for k, v in tdata[row_name].items()}
+            if row_name.startswith("Module: "):
+                tdata[row_name]["time"] = report.runtimes["mods"].get(row_name[len("Module: ") :])
+
+        headers = OrderedDict()
+        headers["peak_rss"] = {
+            "title": "Peak RSS",
+            "description": "Highest resident set size (memory used by the MultiQC process) while running",
+            "suffix": " MB",
+            "format": "{:,.1f}",
+            "scale": "OrRd",
+        }
+        headers["rss_delta"] = {
+            "title": "RSS change",
+            "description": "Change in resident set size from start to finish",
+            "suffix": " MB",
+            "format": "{:,.1f}",
+            "scale": "RdYlGn-rev",
+        }
+        if config.profile_runtime_tracemalloc:
+            headers["peak_alloc"] = {
+                "title": "Peak allocated",
+                "description": "Highest Python memory allocations while running, above the allocations at the start",
+                "suffix": " MB",
+                "format": "{:,.1f}",
+                "scale": "OrRd",
+            }
+            headers["alloc_delta"] = {
+                "title": "Allocated",
+                "description": "Python memory still allocated at the end, compared to the start",
+                "suffix": " MB",
+                "format": "{:,.1f}",
+                "scale": "RdYlGn-rev",
+            }
+        headers["time"] = {
+            "title": "Time",
+            "description": "Module run time",
+            "suffix": " s",
+            "format": "{:,.2f}",
+            "scale": "Blues",
+        }
+
+        pconfig = {
+            "id": "multiqc_runtime_memory_table",
+            "table_title": "MultiQC: Memory use",
+            "col1_header": "Phase / module",
+            "no_beeswarm": True,
+            "sortRows": False,
+        }
+
+        self.add_section(
+            name="Memory use",
+            anchor="multiqc_runtime_memory",
+            description="""
+                Memory used by the file search and by each module.
+                The compression and report template phases run after this report section is made, so are only in
+                `multiqc_runtime_memory.json` in the data directory, along with the numbers shown here.
+            """,
+            helptext="""
+                * `Peak RSS` - The most memory used by the MultiQC process (resident set size) during this phase or module.
+                  Use this to size cluster jobs. On systems other than Linux, this is the peak since MultiQC started.
+                * `RSS change` - How much more memory the process used at the end than at the start
+                * `Peak allocated` / `Allocated` - Python memory allocations during this phase or module, traced
+                  with `tracemalloc`. Only shown with `profile_runtime_tracemalloc: true`, as this slows MultiQC
+                  down a lot, so the run times will be much longer than usual.
+
+                With `--module-workers`, modules are measured in their worker process and the
+                `Running modules` phase only covers the main process.
+            """,
+            plot=table.plot(tdata, headers, pconfig),
+        )
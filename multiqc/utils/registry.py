@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+""" MultiQC module registry. Finds the modules, templates, hooks and command
+line options provided by MultiQC and plugin packages (setuptools entry points)
+and caches them on disk, so that installed packages don't have to be scanned
+every time MultiQC starts. """
+
+from __future__ import print_function
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+
+from multiqc.utils import cache_files
+
+# Entry point groups used by MultiQC
+groups = ["multiqc.modules.v1", "multiqc.templates.v1", "multiqc.hooks.v1", "multiqc.cli_options.v1"]
+
+# Distributions whose versions are recorded in the registry
+distributions = ["multiqc"]
+
+# Registries kept in the cache file, for different Python environments / search paths
+max_cached = 10
+
+# How the registry was loaded, for --profile-runtime
+load_stats = {"time": 0, "cached": False}
+
+_registry = None
+
+
+class EntryPoint(object):
+    """
+    A plugin entry point, 'name = module:attr'. Only imported when load() is called.
+    Same interface as the pkg_resources / importlib.metadata entry points that MultiQC uses.
+    """
+
+    def __init__(self, name, value, group):
+        self.name = name
+        self.value = value
+        self.group = group
+
+    @property
+    def module_name(self):
+        return self.value.split(":")[0].strip()
+
+    def load(self):
+        module_name, _, attrs = self.value.partition(":")
+        module = importlib.import_module(module_name.strip())
+        obj = module
+        for attr in attrs.split("[")[0].strip().split(".") if attrs.strip() else []:
+            obj = getattr(obj, attr)
+        return obj
+
+    def __str__(self):
+        return "{} = {}".format(self.name, self.value)
+
+    def __repr__(self):
+        return "EntryPoint({!r}, {!r}, {!r})".format(self.name, self.value, self.group)
+
+
+def cache_path():
+    """
+    Where the registry is cached: $MULTIQC_REGISTRY_CACHE if set (empty to disable the cache),
+    otherwise in the user cache directory.
+    """
+    if "MULTIQC_REGISTRY_CACHE" in os.environ:
+        return os.environ["MULTIQC_REGISTRY_CACHE"] or None
+    return cache_files.cache_path("registry.json")
+
+
+def fingerprint():
+    """
+    Hash the Python search path and the modification times of the metadata of every
+    installed distribution on it. Installing, upgrading or removing any package changes this.
+    """
+    h = hashlib.sha1()
+    h.update(sys.version.encode("utf-8"))
+    cwd = os.getcwd()
+    for path in sys.path:
+        h.update(path.encode("utf-8", "surrogateescape"))
+        try:
+            h.update(str(os.stat(path or ".").st_mtime_ns).encode("utf-8"))
+        except OSError:
+            continue
+        # Don't list the working directory, which could be a directory full of data
+        if os.path.abspath(path or ".") == cwd:
+            continue
+        try:
+            entries = sorted(os.scandir(path), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.name.endswith((".dist-info", ".egg-info", ".egg-link", ".pth")):
+                continue
+            try:
+                mtime = entry.stat().st_mtime_ns
+                if entry.is_dir():
+                    ep_path = os.path.join(entry.path, "entry_points.txt")
+                    if os.path.exists(ep_path):
+                        mtime = (mtime, os.stat(ep_path).st_mtime_ns)
+            except OSError:
+                continue
+            h.update("{}:{}".format(entry.name, mtime).encode("utf-8", "surrogateescape"))
+    return h.hexdigest()
+
+
+def _scan():
+    """Find entry points and versions in the installed distributions"""
+    # Imported here, as they are slow to import and not needed when the cache is used
+    try:
+        import importlib.metadata as importlib_metadata
+    except ImportError:
+        # Python < 3.8
+        try:
+            import importlib_metadata
+        except ImportError:
+            importlib_metadata = None
+
+    registry = {"groups": {group: list() for group in groups}, "versions": dict()}
+    if importlib_metadata is not None:
+        eps = importlib_metadata.entry_points()
+        for group in groups:
+            if hasattr(eps, "select"):
+                group_eps = eps.select(group=group)
+            else:
+                group_eps = eps.get(group, [])
+            registry["groups"][group] = [[ep.name, ep.value] for ep in group_eps]
+        for dist in distributions:
+            try:
+                registry["versions"][dist] = importlib_metadata.version(dist)
+            except importlib_metadata.PackageNotFoundError:
+                registry["versions"][dist] = None
+    else:
+        import pkg_resources
+
+        for group in groups:
+            registry["groups"][group] = [
+                [ep.name, str(ep).split("=", 1)[1].strip()] for ep in pkg_resources.iter_entry_points(group)
+            ]
+        for dist in distributions:
+            try:
+                registry["versions"][dist] = pkg_resources.get_distribution(dist).version
+            except pkg_resources.DistributionNotFound:
+                registry["versions"][dist] = None
+    return registry
+
+
+def _load_cache(path):
+    """The cached registries, keyed by fingerprint"""
+    try:
+        with open(path) as fh:
+            cached = json.load(fh)
+        if isinstance(cached, dict):
+            return cached
+    except (IOError, OSError, ValueError):
+        pass
+    return dict()
+
+
+def _save_cache(path, cached, key, registry):
+    """Add a registry to the cache, dropping the oldest ones"""
+    cached.pop(key, None)
+    cached[key] = registry
+    while len(cached) > max_cached:
+        cached.pop(next(iter(cached)))
+    try:
+        cache_files.write_atomic(path, lambda fh: json.dump(cached, fh))
+    except (IOError, OSError):
+        pass
+
+
+def get_registry():
+    """Load the registry from the cache if it's up to date, otherwise scan the installed packages"""
+    global _registry
+    if _registry is not None:
+        return _registry
+    start = time.time()
+    path = cache_path()
+    registry = None
+    if path:
+        key = fingerprint()
+        cached = _load_cache(path)
+        registry = cached.get(key)
+        if not isinstance(registry, dict) or set(registry.get("groups", [])) != set(groups):
+            registry = None
+    load_stats["cached"] = registry is not None
+    if registry is None:
+        registry = _scan()
+        if path:
+            _save_cache(path, cached, key, registry)
+    _registry = registry
+    load_stats["time"] = time.time() - start
+    return _registry
+
+
+def entry_points(group):
+    """All entry points in a group, in the order that they were found"""
+    return [EntryPoint(name, value, group) for name, value in get_registry()["groups"].get(group, [])]
+
+
+def version(dist):
+    """Installed version of a distribution, or None if it isn't installed"""
+    return get_registry()["versions"].get(dist)
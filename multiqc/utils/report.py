@@ -5,8 +5,13 @@ module. Is available to subsequent modules. Contains
 helper functions to generate markup for report. """
 
 from __future__ import print_function
-from collections import defaultdict, OrderedDict
+from collections import Counter, defaultdict, namedtuple, OrderedDict
+from collections.abc import MutableMapping
+import bisect
+import concurrent.futures
 import fnmatch
+import functools
+import hashlib
 import inspect
 import io
 import json
@@ -14,11 +19,14 @@ import lzstring
 import mimetypes
 import os
 import re
-import rich.progress
+import sqlite3
+import stat
+import sys
 import time
 import yaml
 
 from multiqc import config
+from multiqc.utils import archives, search_cache, util_functions
 
 logger = config.logger
 
@@ -44,8 +52,13 @@ num_hc_plots = 0
 num_mpl_plots = 0
 saved_raw_data = dict()
 last_found_file = None
+# Report variables that modules add to (as well as data_sources and modules_output)
+module_report_lists = ["general_stats_data", "general_stats_headers", "html_ids", "lint_errors"]
+module_report_dicts = ["plot_data", "saved_raw_data"]
+module_report_counts = ["num_hc_plots", "num_mpl_plots"]
 runtimes = {
     "total": 0,
+    "startup": 0,
     "total_sp": 0,
     "total_mods": 0,
     "total_compression": 0,
@@ -59,10 +72,16 @@ file_search_stats = {
     "skipped_filesize_limit": 0,
     "skipped_no_match": 0,
 }
+# File reads made by each search key during the file search, for --profile-runtime
+search_io_stats = dict()
+# Memory used by each phase of the run and each module, for --profile-runtime
+memory_usage = {"phases": OrderedDict(), "mods": OrderedDict()}
 
 # Make a dict of discovered files for each seach key
 searchfiles = list()
 files = dict()
+# Other paths to the same files, if config.dedupe_files is set. Keyed by absolute path.
+file_aliases = dict()
 
 
 def get_filelist(run_module_names):
@@ -73,6 +92,7 @@ def get_filelist(run_module_names):
     # Prep search patterns
     spatterns = [{}, {}, {}, {}, {}, {}, {}]
     runtimes["sp"] = defaultdict()
+    search_io_stats.clear()
     ignored_patterns = []
     skipped_patterns = []
     for key, sps in config.sp.items():
@@ -125,6 +145,33 @@ def get_filelist(run_module_names):
         else:
             spatterns[0][key] = sps
 
+    # Compile the ignore patterns once, rather than for every file and directory
+    ignore_files_re = compile_fnmatch(config.fn_ignore_files)
+    ignore_dirs_re = compile_fnmatch([n.rstrip(os.sep) for n in config.fn_ignore_dirs])
+    ignore_paths_re = compile_fnmatch([n.rstrip(os.sep) for n in config.fn_ignore_paths])
+
+    # Index the search patterns by filename, in the order that they should be evaluated
+    sp_order = [(key, sps) for patterns in spatterns for key, sps in patterns.items()]
+    sp_fingerprint = search_cache.search_fingerprint(sp_order)
+    sp_order_stats = dict()
+    if config.search_order_adaptive:
+        sp_order_stats = load_search_order_stats(config.search_order_stats)
+        sp_order = order_search_patterns(spatterns, sp_order_stats)
+    sp_index = SearchPatternIndex(sp_order)
+
+    # Combine all regex contents patterns so that most lines can be skipped with a single search
+    contents_re_prefilter = compile_contents_re_prefilter(
+        [sp["contents_re"] for key, sps in sp_order for sp in sps if "contents_re" in sp]
+    )
+
+    # Open the file search cache, if we're using one
+    sf_cache = None
+    if config.search_cache:
+        try:
+            sf_cache = search_cache.SearchCache(config.search_cache, sp_fingerprint)
+        except sqlite3.Error as e:
+            logger.warning("Could not open file search cache '{}': {}".format(config.search_cache, e))
+
     if len(ignored_patterns) > 0:
         logger.debug("Ignored {} search patterns as didn't match running modules.".format(len(ignored_patterns)))
 
@@ -132,59 +179,239 @@ def get_filelist(run_module_names):
         logger.info("Skipping {} file search patterns".format(len(skipped_patterns)))
         logger.debug("Skipping search patterns: {}".format(", ".join(skipped_patterns)))
 
-    def add_file(fn, root):
+    def add_file(fn, root, st=None):
         """
         Function applied to each file found when walking the analysis
-        directories. Runs through all search patterns and returns True
-        if a match is found.
+        directories. Runs through all search patterns and returns a tuple
+        with whether a match was found, the list of (search key, file) matches,
+        the name of the skip statistic to increment (if any) and the time
+        spent on each search key.
+        Does not modify any global state, so that it can be run in parallel.
+        :param st: os.stat() result for the file, if already known
         """
-        f = {"fn": fn, "root": root}
+        f = SearchFile(fn, root)
+        matches = list()
+        sp_stats = dict()
+
+        if st is None:
+            try:
+                st = os.stat(os.path.join(root, fn))
+            except (IOError, OSError, ValueError):
+                pass
 
         # Check that this is a file and not a pipe or anything weird
-        if not os.path.isfile(os.path.join(root, fn)):
-            file_search_stats["skipped_not_a_file"] += 1
-            return False
+        if st is None or not stat.S_ISREG(st.st_mode):
+            return False, matches, "skipped_not_a_file", sp_stats
 
         # Check that we don't want to ignore this file
-        i_matches = [n for n in config.fn_ignore_files if fnmatch.fnmatch(fn, n)]
-        if len(i_matches) > 0:
+        if ignore_files_re is not None and ignore_files_re.match(os.path.normcase(fn)):
             logger.debug("Ignoring file as matched an ignore pattern: {}".format(fn))
-            file_search_stats["skipped_ignore_pattern"] += 1
-            return False
+            return False, matches, "skipped_ignore_pattern", sp_stats
 
         # Limit search to small files, to avoid 30GB FastQ files etc.
-        try:
-            f["filesize"] = os.path.getsize(os.path.join(root, fn))
-        except (IOError, OSError, ValueError, UnicodeDecodeError):
-            logger.debug("Couldn't read file when checking filesize: {}".format(fn))
-        else:
-            if f["filesize"] > config.log_filesize_limit:
-                file_search_stats["skipped_filesize_limit"] += 1
-                return False
+        f["filesize"] = st.st_size
+        if f["filesize"] > config.log_filesize_limit:
+            return False, matches, "skipped_filesize_limit", sp_stats
+
+        # Skip binary files - no search pattern can match them
+        if exclude_file_type(f):
+            return False, matches, None, sp_stats
+
+        # Archives can only be matched by filename. Their contents would be the
+        # decompressed archive stream, which would match the patterns for the files inside.
+        filename_only = archives.is_archive(fn) and (config.search_archives or config.decompress_logs)
+        file_matched, matches, sp_stats = search_patterns(f, filename_only=filename_only)
+        return file_matched, matches, None, sp_stats
 
-        # Test file for each search pattern
+    def search_patterns(f, opener=None, filename_only=False):
+        """
+        Test a file against each search pattern that could match its filename.
+        File contents are read once and shared between all patterns.
+        Returns whether a match was found, the list of (search key, file) matches
+        and a dict of statistics for each search key: the time spent and, if
+        config.profile_runtime is set, the files tested and matched and the file
+        reads made (see SearchFileContents.io_stats).
+        :param opener: Function returning a text file handle, if not opening the file from disk
+        :param filename_only: Skip the patterns that need to search the file contents
+        """
+        matches = list()
+        sp_stats = dict()
         file_matched = False
-        for patterns in spatterns:
-            for key, sps in patterns.items():
+        sp_candidates, key_positions = sp_index.candidates(*search_filenames(f["fn"]))
+        path = os.path.join(f["root"], f["fn"])
+        count_io = config.profile_runtime
+        with SearchFileContents(path, contents_re_prefilter, opener, count_io) as contents:
+            for key_pos in key_positions:
+                key, sps = sp_order[key_pos]
+                key_stats = sp_stats[key] = {"time": 0}
+                if count_io:
+                    key_stats["files_tested"] = 1
+                    key_stats["files_matched"] = 0
+                    contents.sp_key = key
                 start = time.time()
+                stop_search = False
                 for sp in sps:
-                    if search_file(sp, f, key):
+                    if id(sp) not in sp_candidates:
+                        continue
+                    if filename_only and ("contents" in sp or "contents_re" in sp):
+                        continue
+                    if search_file(sp, f, key, contents, check_file_type=False):
                         # Check that we shouldn't exclude this file
-                        if not exclude_file(sp, f):
+                        if not exclude_file(sp, f, contents):
                             # Looks good! Remember this file
-                            files[key].append(f)
-                            file_search_stats[key] = file_search_stats.get(key, 0) + 1
+                            matches.append((key, f))
                             file_matched = True
+                            if count_io:
+                                key_stats["files_matched"] = 1
                         # Don't keep searching this file for other modules
                         if not sp.get("shared", False):
-                            runtimes["sp"][key] = runtimes["sp"].get(key, 0) + (time.time() - start)
-                            return True
+                            file_matched = True
+                            stop_search = True
                         # Don't look at other patterns for this module
-                        else:
-                            break
-                runtimes["sp"][key] = runtimes["sp"].get(key, 0) + (time.time() - start)
+                        break
+                key_stats["time"] += time.time() - start
+                if stop_search:
+                    break
+        if count_io:
+            for key, io_stats in contents.io_stats.items():
+                sp_stats[key].update(io_stats)
+
+        return file_matched, matches, sp_stats
 
-        return file_matched
+    def add_archive(fn, root):
+        """
+        Search the files inside a tar or zip archive, as if they were in a
+        directory with the same name as the archive. Archives are read in a
+        single pass and nothing is extracted to disk.
+        Returns a tuple like add_file(), with the matches for all files in the archive.
+        """
+        path = os.path.join(root, fn)
+        file_matched = False
+        matches = list()
+        sp_stats = dict()
+        try:
+            with archives.Archive(path) as archive:
+                for name, size in archive.members():
+                    m_root, m_fn = archives.member_path(path, name)
+                    if ignore_files_re is not None and ignore_files_re.match(os.path.normcase(m_fn)):
+                        continue
+                    if ignore_dirs_re is not None and any(
+                        ignore_dirs_re.match(os.path.normcase(d)) for d in name.split("/")[:-1]
+                    ):
+                        continue
+                    if ignore_paths_re is not None and ignore_paths_re.match(os.path.normcase(m_root)):
+                        continue
+                    f = SearchFile(m_fn, m_root, size, archive=path, archive_member=name)
+                    if size > config.log_filesize_limit or exclude_file_type(f):
+                        continue
+                    m_matched, m_matches, m_stats = search_patterns(f, functools.partial(archive.open, name))
+                    file_matched = file_matched or m_matched
+                    matches.extend(m_matches)
+                    for key, key_stats in m_stats.items():
+                        sp_stats.setdefault(key, Counter()).update(key_stats)
+        except util_functions.file_read_errors as e:
+            logger.debug("Couldn't read archive when searching for files: {} ({})".format(path, e))
+        return file_matched, matches, None, sp_stats
+
+    def add_file_cached(fn, root, st=None, sp_key=None):
+        """
+        Wrapper around add_file() that uses the file search cache if we have one.
+        Files that have not changed since the cached search are not searched again.
+        Files from a manifest with a search key are assigned to that key without searching.
+        Archives are searched inside if config.search_archives is set, and are not cached.
+        """
+        if sp_key is not None:
+            return add_manifest_file(fn, root, st, sp_key)
+        # Look inside archives that aren't matched by a search pattern themselves
+        if config.search_archives and archives.is_archive(fn):
+            result = add_file(fn, root, st)
+            if result[0] or result[2] in ("skipped_not_a_file", "skipped_ignore_pattern"):
+                return result
+            return add_archive(fn, root)
+        # Manifest entries only have a file size, so can't be checked against the cache
+        if sf_cache is None or (st is not None and st.st_mtime_ns is None):
+            return add_file(fn, root, st)
+        path = os.path.abspath(os.path.join(root, fn))
+        if st is None:
+            try:
+                st = os.stat(path)
+            except (IOError, OSError, ValueError):
+                return add_file(fn, root)
+        cached = sf_cache.get(path, st)
+        if cached is not None:
+            file_matched, keys, skipped, filesize = cached
+            f = SearchFile(fn, root, filesize)
+            return file_matched, [(key, f) for key in keys], skipped, {}
+        result = add_file(fn, root, st)
+        file_matched, matches, skipped, sp_stats = result
+        filesize = matches[0][1].get("filesize") if len(matches) > 0 else None
+        sf_cache.set(path, st, [file_matched, [key for key, f in matches], skipped, filesize])
+        return result
+
+    def add_manifest_file(fn, root, st, sp_key):
+        """
+        Add a file from a manifest that already told us its search key.
+        The file is not searched at all, only checked against the ignore and filesize options.
+        """
+        f = SearchFile(fn, root)
+        if st is not None:
+            f["filesize"] = st.st_size
+            if f["filesize"] > config.log_filesize_limit:
+                return False, [], "skipped_filesize_limit", {}
+        if ignore_files_re is not None and ignore_files_re.match(os.path.normcase(fn)):
+            logger.debug("Ignoring file as matched an ignore pattern: {}".format(fn))
+            return False, [], "skipped_ignore_pattern", {}
+        if sp_key not in files:
+            if sp_key not in config.sp:
+                logger.warning("Unrecognised search pattern key in manifest: {}".format(sp_key))
+            return False, [], None, {}
+        return True, [(sp_key, f)], None, {}
+
+    def ignore_manifest_dir(root):
+        """Whether a directory of a manifest file, or any directory above it, matches fn_ignore_dirs or fn_ignore_paths"""
+        if ignore_dirs_re is not None:
+            for d in root.split(os.sep):
+                if ignore_dirs_re.match(os.path.normcase(d)):
+                    logger.debug("Ignoring manifest files in directory as matched fn_ignore_dirs: {}".format(root))
+                    return True
+        if ignore_paths_re is not None:
+            dir_path = root
+            while dir_path:
+                if ignore_paths_re.match(os.path.normcase(dir_path)):
+                    logger.debug("Ignoring manifest files in directory as matched fn_ignore_paths: {}".format(root))
+                    return True
+                parent = os.path.dirname(dir_path)
+                if parent == dir_path:
+                    break
+                dir_path = parent
+        return False
+
+    def search_order_stats():
+        """Search time and number of matches for each search key so far in this run"""
+        return {key: {"time": runtimes["sp"].get(key, 0), "matches": len(files[key])} for key in files}
+
+    def add_file_chunk(chunk):
+        """Run add_file() on a list of [fn, root, stat, (sp_key)] search files, for the worker pool"""
+        return [add_file_cached(*sf) for sf in chunk]
+
+    def record_file(result):
+        """
+        Merge the result of add_file() into the global report variables.
+        Always called from the main thread in search file order, so that
+        the serial and parallel search give identical results.
+        """
+        file_matched, matches, skipped, sp_stats = result
+        for key, f in matches:
+            files[key].append(f)
+            file_search_stats[key] = file_search_stats.get(key, 0) + 1
+        for key, key_stats in sp_stats.items():
+            runtimes["sp"][key] = runtimes["sp"].get(key, 0) + key_stats["time"]
+            if len(key_stats) > 1:
+                search_io_stats.setdefault(key, Counter()).update(key_stats)
+        if skipped is not None:
+            file_search_stats[skipped] += 1
+        if not file_matched:
+            file_search_stats["skipped_no_match"] += 1
 
     # Go through the analysis directories and get file list
     multiqc_installation_dir_files = [
@@ -199,61 +426,86 @@ def get_filelist(run_module_names):
         ".gitignore",
     ]
     total_sp_starttime = time.time()
+
+    # Files from a manifest weren't found by walking directories, so skip the
+    # ones in directories that the walk below would have ignored
+    if len(searchfiles) > 0:
+        ignored_roots = dict()
+        manifest_files = list()
+        for sf in searchfiles:
+            if sf[1] not in ignored_roots:
+                ignored_roots[sf[1]] = ignore_manifest_dir(sf[1])
+            if ignored_roots[sf[1]]:
+                file_search_stats["skipped_ignore_pattern"] += 1
+            else:
+                manifest_files.append(sf)
+        searchfiles[:] = manifest_files
+
     for path in config.analysis_dir:
         if os.path.islink(path) and config.ignore_symlinks:
             file_search_stats["skipped_symlinks"] += 1
             continue
         elif os.path.isfile(path):
-            searchfiles.append([os.path.basename(path), os.path.dirname(path)])
+            searchfiles.append((os.path.basename(path), os.path.dirname(path)))
         elif os.path.isdir(path):
-            for root, dirnames, filenames in os.walk(path, followlinks=(not config.ignore_symlinks), topdown=True):
+            for root, dirnames, file_entries in scan_dir(
+                path, followlinks=(not config.ignore_symlinks), workers=config.walk_workers
+            ):
                 bname = os.path.basename(root)
 
                 # Skip any sub-directories matching ignore params
-                orig_dirnames = dirnames[:]
-                for n in config.fn_ignore_dirs:
-                    dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(d, n.rstrip(os.sep))]
-                    if len(orig_dirnames) != len(dirnames):
-                        removed_dirs = [
-                            os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))
-                        ]
-                        logger.debug("Ignoring directory as matched fn_ignore_dirs: {}".format(", ".join(removed_dirs)))
-                        orig_dirnames = dirnames[:]
-                for n in config.fn_ignore_paths:
-                    dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(os.path.join(root, d), n.rstrip(os.sep))]
-                    if len(orig_dirnames) != len(dirnames):
-                        removed_dirs = [
-                            os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))
-                        ]
+                if ignore_dirs_re is not None:
+                    removed_dirs = [d for d in dirnames if ignore_dirs_re.match(os.path.normcase(d))]
+                    if len(removed_dirs) > 0:
+                        dirnames[:] = [d for d in dirnames if d not in removed_dirs]
                         logger.debug(
-                            "Ignoring directory as matched fn_ignore_paths: {}".format(", ".join(removed_dirs))
+                            "Ignoring directory as matched fn_ignore_dirs: {}".format(
+                                ", ".join([os.path.join(root, d) for d in removed_dirs])
+                            )
+                        )
+                if ignore_paths_re is not None:
+                    removed_dirs = [
+                        d for d in dirnames if ignore_paths_re.match(os.path.normcase(os.path.join(root, d)))
+                    ]
+                    if len(removed_dirs) > 0:
+                        dirnames[:] = [d for d in dirnames if d not in removed_dirs]
+                        logger.debug(
+                            "Ignoring directory as matched fn_ignore_paths: {}".format(
+                                ", ".join([os.path.join(root, d) for d in removed_dirs])
+                            )
                         )
 
                 # Skip *this* directory if matches ignore params
-                d_matches = [n for n in config.fn_ignore_dirs if fnmatch.fnmatch(bname, n.rstrip(os.sep))]
-                if len(d_matches) > 0:
+                if ignore_dirs_re is not None and ignore_dirs_re.match(os.path.normcase(bname)):
                     logger.debug("Ignoring directory as matched fn_ignore_dirs: {}".format(bname))
                     continue
-                p_matches = [n for n in config.fn_ignore_paths if fnmatch.fnmatch(root, n.rstrip(os.sep))]
-                if len(p_matches) > 0:
+                if ignore_paths_re is not None and ignore_paths_re.match(os.path.normcase(root)):
                     logger.debug("Ignoring directory as matched fn_ignore_paths: {}".format(root))
                     continue
 
                 # Sanity check - make sure that we're not just running in the installation directory
+                filenames = set(entry.name for entry in file_entries)
                 if len(filenames) > 0 and all([fn in filenames for fn in multiqc_installation_dir_files]):
                     logger.error("Error: MultiQC is running in source code directory! {}".format(root))
                     logger.warning(
                         "Please see the docs for how to use MultiQC: https://multiqc.info/docs/#running-multiqc"
                     )
                     dirnames[:] = []
-                    filenames[:] = []
                     continue
 
                 # Search filenames in this directory
-                for fn in filenames:
-                    searchfiles.append([fn, root])
+                # Keep the stat result from scandir, so that we don't need to look it up again
+                for entry in file_entries:
+                    try:
+                        st = FileStat.from_stat(entry.stat())
+                    except (IOError, OSError, ValueError):
+                        st = None
+                    searchfiles.append((entry.name, root, st))
 
     # Search through collected files
+    # Imported here, as it's only needed once files are being searched
+    import rich.progress
+
     progress_obj = rich.progress.Progress(
         "[blue]|[/]      ",
         rich.progress.SpinnerColumn(),
@@ -263,32 +515,719 @@ def get_filelist(run_module_names):
         "[green]{task.completed}/{task.total}",
         "[dim]{task.fields[s_fn]}",
     )
+    # Only search each physical file once
+    if config.dedupe_files:
+        num_removed = dedupe_searchfiles(by_content=(config.dedupe_files == "content"))
+        if num_removed > 0:
+            logger.info("Skipping {} duplicate files (symlinks, hard links or identical copies)".format(num_removed))
+        file_search_stats["skipped_duplicate"] = num_removed
+
+    # With adaptive ordering but no saved statistics, search the first files in the default
+    # order and then reorder the search patterns using their statistics from those files
+    search_phases = [searchfiles]
+    if config.search_order_adaptive and len(sp_order_stats) == 0:
+        search_phases = [searchfiles[: config.search_order_warmup], searchfiles[config.search_order_warmup :]]
     with progress_obj as progress:
         mqc_task = progress.add_task("searching", total=len(searchfiles), s_fn="")
-        for sf in searchfiles:
-            progress.update(mqc_task, advance=1, s_fn=os.path.join(sf[1], sf[0])[-50:])
-            if not add_file(sf[0], sf[1]):
-                file_search_stats["skipped_no_match"] += 1
+        for phase_idx, phase_files in enumerate(search_phases):
+            if phase_idx > 0 and len(phase_files) > 0:
+                sp_order = order_search_patterns(spatterns, search_order_stats())
+                sp_index = SearchPatternIndex(sp_order)
+                logger.debug("Reordered search patterns after searching {} files".format(len(search_phases[0])))
+            if config.search_workers is not None and config.search_workers > 1:
+                # Search files in parallel. Chunks are returned in order by map(), so results
+                # are merged in exactly the same order as the serial search below.
+                logger.debug("Searching files using {} worker threads".format(config.search_workers))
+                chunksize = 500
+                chunks = [phase_files[i : i + chunksize] for i in range(0, len(phase_files), chunksize)]
+                with concurrent.futures.ThreadPoolExecutor(max_workers=config.search_workers) as executor:
+                    for chunk, results in zip(chunks, executor.map(add_file_chunk, chunks)):
+                        for result in results:
+                            record_file(result)
+                        progress.update(
+                            mqc_task, advance=len(chunk), s_fn=os.path.join(chunk[-1][1], chunk[-1][0])[-50:]
+                        )
+            else:
+                for sf in phase_files:
+                    progress.update(mqc_task, advance=1, s_fn=os.path.join(sf[1], sf[0])[-50:])
+                    record_file(add_file_cached(*sf))
         progress.update(mqc_task, s_fn="")
 
+    if config.search_order_stats:
+        save_search_order_stats(config.search_order_stats, sp_order_stats, search_order_stats())
+
+    if sf_cache is not None:
+        logger.info(
+            "Search cache: {} of {} files unchanged since previous search".format(sf_cache.hits, len(searchfiles))
+        )
+        sf_cache.save()
+
+    # Only the file names are needed once the search is done (for the old find_log_files() dict syntax)
+    searchfiles[:] = [sf[:2] for sf in searchfiles]
+
     runtimes["total_sp"] = time.time() - total_sp_starttime
 
 
-def search_file(pattern, f, module_key):
+def load_search_order_stats(path):
+    """
+    Load search key statistics saved by a previous run, for ordering the search patterns.
+    Returns a dict of search key: {'time', 'matches'}, empty if there is no file.
+    """
+    if not path or not os.path.isfile(path):
+        return dict()
+    try:
+        with io.open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError) as e:
+        logger.warning("Could not load search pattern statistics '{}': {}".format(path, e))
+        return dict()
+
+
+def save_search_order_stats(path, previous_stats, run_stats):
+    """Add the search key statistics from this run to those from previous runs, and save them"""
+    stats = {key: dict(key_stats) for key, key_stats in previous_stats.items()}
+    for key, key_stats in run_stats.items():
+        saved = stats.setdefault(key, {"time": 0, "matches": 0})
+        saved["time"] += key_stats["time"]
+        saved["matches"] += key_stats["matches"]
+    try:
+        with io.open(path, "w", encoding="utf-8") as fh:
+            json.dump(stats, fh, indent=4, sort_keys=True)
+    except (IOError, OSError) as e:
+        logger.warning("Could not save search pattern statistics '{}': {}".format(path, e))
+
+
+def order_search_patterns(spatterns, stats):
+    """
+    Order the search keys within each speed group by their expected search time per
+    matched file, so that the keys that match the most files for the least work are
+    tried first. Search keys without any matches keep their default order, at the end
+    of their group. Returns a list of (key, search patterns) like sp_order.
+    """
+
+    def cost_per_match(key):
+        key_stats = stats.get(key)
+        if key_stats is None or key_stats.get("matches", 0) == 0:
+            return float("inf")
+        return key_stats.get("time", 0) / key_stats["matches"]
+
+    sp_order = list()
+    for patterns in spatterns:
+        for key in sorted(patterns, key=cost_per_match):
+            sp_order.append((key, patterns[key]))
+    return sp_order
+
+
+def load_manifest(manifest_fh):
+    """
+    Add files to report.searchfiles from a manifest, instead of walking directories.
+    Each line is either tab-separated (path, file size, search pattern key)
+    or a JSON object with 'path', 'size' and 'module' keys. The size and key are optional.
+    The file size from the manifest is used instead of looking it up on the filesystem,
+    and files with a search key are given to that module without being searched.
+    Returns the number of files added.
+    """
+    num_files = 0
+    for line_num, line in enumerate(manifest_fh, 1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith("#"):
+            continue
+        try:
+            if line.startswith("{"):
+                entry = json.loads(line)
+                path, size, sp_key = entry["path"], entry.get("size"), entry.get("module")
+            else:
+                cols = line.split("\t")
+                path = cols[0]
+                size = cols[1] if len(cols) > 1 and cols[1] != "" else None
+                sp_key = cols[2] if len(cols) > 2 and cols[2] != "" else None
+                # Skip a header row
+                if line_num == 1 and size is not None and not size.isdigit():
+                    continue
+            st = None
+            if size is not None:
+                # Fake stat result - the manifest tells us that this is a file of this size
+                st = FileStat(int(size), None, 0, 0, stat.S_IFREG)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Could not parse manifest line {}: {} ({})".format(line_num, line, e))
+            continue
+        # Intern directory names, so that files in the same directory share one string
+        record = (os.path.basename(path), sys.intern(os.path.dirname(path)), st)
+        if sp_key is not None:
+            record += (sp_key,)
+        searchfiles.append(record)
+        num_files += 1
+    return num_files
+
+
+def list_dir(root, stat_files=False):
+    """
+    List the contents of a directory for scan_dir().
+    Returns a tuple of the sub-directory names, a dict of their os.DirEntry objects
+    and a list of os.DirEntry objects for everything else, or None if the directory
+    can't be read.
+    :param stat_files: Call stat() on the files now, so the result is cached in the entries
+    """
+    dirnames = list()
+    dir_entries = dict()
+    file_entries = list()
+    try:
+        with os.scandir(root) as scandir_it:
+            for entry in scandir_it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirnames.append(entry.name)
+                    dir_entries[entry.name] = entry
+                else:
+                    file_entries.append(entry)
+    except OSError:
+        # Same as os.walk() - skip directories that we can't read
+        return None
+    if stat_files:
+        for entry in file_entries:
+            try:
+                entry.stat()
+            except OSError:
+                pass
+    return dirnames, dir_entries, file_entries
+
+
+def scan_dir(top, followlinks=False, workers=1):
+    """
+    Walk a directory tree in the same order as os.walk(topdown=True),
+    but built on os.scandir() and yielding the os.DirEntry objects for files.
+    File types and stat results can then be taken from the directory entries,
+    instead of looking them up again for each path.
+    Yields (root, dirnames, file_entries). Modify dirnames in place to prune the walk.
+    :param workers: Number of threads to list sub-directories concurrently with.
+                    Directories are still yielded in the same order.
+    """
+    executor = None
+    if workers is not None and workers > 1:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    stack = [(top, None)]
+    try:
+        while stack:
+            root, future = stack.pop()
+            listing = future.result() if future is not None else list_dir(root)
+            if listing is None:
+                continue
+            dirnames, dir_entries, file_entries = listing
+
+            yield root, dirnames, file_entries
+
+            # Find which sub-directories to walk, after the caller has pruned dirnames
+            subdirs = list()
+            for dirname in dirnames:
+                entry = dir_entries.get(dirname)
+                subdir = os.path.join(root, dirname)
+                try:
+                    if entry is not None:
+                        is_symlink = entry.is_symlink()
+                    else:
+                        is_symlink = os.path.islink(subdir)
+                except OSError:
+                    is_symlink = False
+                if is_symlink:
+                    if not followlinks:
+                        continue
+                    # Don't follow symlinks back to a directory that we're already in, or we'd never finish
+                    if is_symlink_loop(root, subdir):
+                        logger.debug("Not following symlink to a parent directory: {}".format(subdir))
+                        continue
+                subdirs.append(subdir)
+
+            # Start listing the sub-directories in the background, in walk order
+            futures = [None] * len(subdirs)
+            if executor is not None:
+                futures = [executor.submit(list_dir, subdir, True) for subdir in subdirs]
+
+            # Push sub-directories in reverse, so that they're walked in order
+            for subdir, subdir_future in reversed(list(zip(subdirs, futures))):
+                stack.append((subdir, subdir_future))
+    finally:
+        if executor is not None:
+            for _, future in stack:
+                if future is not None:
+                    future.cancel()
+            executor.shutdown(wait=True)
+
+
+def is_symlink_loop(root, link):
+    """Does the symlinked directory link point to root, or to one of the directories that root is in?"""
+    target = os.path.realpath(link)
+    real_root = os.path.realpath(root)
+    return real_root == target or real_root.startswith(target.rstrip(os.sep) + os.sep)
+
+
+def dedupe_searchfiles(by_content=False):
+    """
+    Remove files from report.searchfiles that are the same physical file as another
+    (same device and inode, eg. symlinks and hard links), so that each file is only
+    searched and parsed once. The paths of the removed copies are saved in report.file_aliases,
+    keyed by the absolute path of the file that was kept (see _keep_one() for which one that is).
+    :param by_content: Also remove files with identical contents to another
+    Returns the number of files removed.
+    """
+    file_aliases.clear()
+    same_inode = dict()
+    unique_files = list()
+    for sf in searchfiles:
+        st = sf[2] if len(sf) > 2 else None
+        if st is None:
+            try:
+                st = os.stat(os.path.join(sf[1], sf[0]))
+            except (IOError, OSError, ValueError):
+                unique_files.append(sf)
+                continue
+        # Files from a manifest don't have a real inode, and can't be compared
+        if not stat.S_ISREG(st.st_mode) or st.st_ino == 0:
+            unique_files.append(sf)
+            continue
+        inode = (st.st_dev, st.st_ino)
+        if inode in same_inode:
+            same_inode[inode][1].append(sf)
+        else:
+            same_inode[inode] = (len(unique_files), [sf])
+            unique_files.append(sf)
+    for idx, same_files in same_inode.values():
+        if len(same_files) > 1:
+            unique_files[idx] = _keep_one(same_files)
+
+    if by_content:
+        # Only hash files that are the same size as another file and small enough to be searched
+        by_size = defaultdict(list)
+        for sf in unique_files:
+            st = sf[2] if len(sf) > 2 else None
+            if st is not None and stat.S_ISREG(st.st_mode) and 0 < st.st_size <= config.log_filesize_limit:
+                by_size[st.st_size].append(sf)
+        replaced = dict()
+        for same_size in by_size.values():
+            if len(same_size) < 2:
+                continue
+            same_hash = defaultdict(list)
+            for sf in same_size:
+                try:
+                    same_hash[hash_file(os.path.join(sf[1], sf[0]))].append(sf)
+                except (IOError, OSError):
+                    continue
+            for same_files in same_hash.values():
+                if len(same_files) > 1:
+                    keep = _keep_one(same_files)
+                    for sf in same_files:
+                        replaced[id(sf)] = keep if sf is same_files[0] else None
+        unique_files = [replaced.get(id(sf), sf) for sf in unique_files]
+        unique_files = [sf for sf in unique_files if sf is not None]
+
+    num_removed = len(searchfiles) - len(unique_files)
+    searchfiles[:] = unique_files
+    return num_removed
+
+
+def _keep_one(same_files):
+    """
+    Choose which of several paths to the same file to keep, and remember the others as its aliases.
+    Paths without symlinks come first, then the shortest path, then alphabetical order, so that
+    the choice (and so the sample name) doesn't depend on the order that directories are listed in.
+    """
+
+    def preference(sf):
+        path = os.path.abspath(os.path.join(sf[1], sf[0]))
+        return (os.path.realpath(path) != path, len(path), path)
+
+    keep = min(same_files, key=preference)
+    for sf in same_files:
+        if sf is not keep:
+            _add_file_alias(keep, sf)
+    return keep
+
+
+def _add_file_alias(sf, alias_sf):
+    """Remember that alias_sf (and any of its own aliases) are other paths to the file sf"""
+    path = os.path.abspath(os.path.join(sf[1], sf[0]))
+    alias_path = os.path.abspath(os.path.join(alias_sf[1], alias_sf[0]))
+    file_aliases.setdefault(path, list()).extend([alias_path] + file_aliases.pop(alias_path, []))
+
+
+def hash_file(path, blocksize=1048576):
+    """SHA1 hash of the contents of a file, read in blocks"""
+    file_hash = hashlib.sha1()
+    with io.open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(blocksize), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def compile_fnmatch(patterns):
+    """
+    Compile a list of glob patterns into a single regex, for checking lots
+    of names against fnmatch.fnmatch() at once. Names should be passed through
+    os.path.normcase() before matching. Returns None if there are no patterns.
+    """
+    if len(patterns) == 0:
+        return None
+    return re.compile("|".join(fnmatch.translate(os.path.normcase(p)) for p in patterns))
+
+
+class FileStat(namedtuple("FileStat", ["st_size", "st_mtime_ns", "st_ino", "st_dev", "st_mode"])):
+    """
+    The parts of an os.stat() result used by the file search, kept in report.searchfiles
+    for every file found. A plain tuple, much smaller than a full os.stat_result.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_stat(cls, st):
+        return cls(st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev, st.st_mode)
+
+
+class SearchFile(MutableMapping):
+    """
+    Compact record of a file found by the file search, used in report.files.
+    The common fields are stored in slots instead of a dict per file, but it
+    behaves like the dict that modules expect: f["fn"], f["root"], f.get("filesize"),
+    and any other keys set by find_log_files() or modules (eg. f["s_name"]).
+    Unset fields are missing keys, so "filesize" in f works as for a dict.
+    """
+
+    __slots__ = ("fn", "root", "filesize", "sp_key", "s_name", "f", "_extra")
+    _fields = frozenset(("fn", "root", "filesize", "sp_key", "s_name", "f"))
+
+    def __init__(self, fn, root, filesize=None, **kwargs):
+        self.fn = fn
+        self.root = root
+        if filesize is not None:
+            self.filesize = filesize
+        self._extra = kwargs or None
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = dict()
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._fields:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self._fields:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in self.__slots__[:-1]:
+            if hasattr(self, key):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, dict(self))
+
+
+class SearchPatternIndex(object):
+    """
+    Index of search patterns by filename, so that each file is only tested
+    against the search patterns that could possibly match it.
+    Glob patterns that are a literal filename, or a literal prefix or suffix
+    with a single '*', are looked up in dicts. All other glob and regex patterns
+    are compiled and combined into one regex that rules out most filenames
+    in a single match. Patterns without filename criteria always apply.
+    """
+
+    def __init__(self, sp_order):
+        # Position of each search key in evaluation order, by search pattern
+        self.key_positions = dict()
+        self.literal = defaultdict(list)
+        self.prefix = defaultdict(list)
+        self.suffix = defaultdict(list)
+        self.fn_globs = list()
+        self.fn_regexes = list()
+        self.any_fn = list()
+        for idx, (key, sps) in enumerate(sp_order):
+            for sp in sps:
+                self.key_positions[id(sp)] = idx
+                self._add(sp)
+        self.prefix_lengths = sorted(set(len(p) for p in self.prefix))
+        self.suffix_lengths = sorted(set(len(p) for p in self.suffix))
+        self.fn_globs_prefilter = self._combine(self.fn_globs)
+        self.fn_regexes_prefilter = self._combine(self.fn_regexes)
+
+    def _add(self, sp):
+        pid = id(sp)
+        if sp.get("fn") is None and sp.get("fn_re") is None:
+            # search_file() never matches patterns with no criteria at all
+            if sp.get("contents") is not None or sp.get("contents_re") is not None:
+                self.any_fn.append(pid)
+            return
+        if sp.get("fn") is not None:
+            fn = os.path.normcase(sp["fn"])
+            wildcards = re.compile(r"[*?\[]")
+            if not wildcards.search(fn):
+                self.literal[fn].append(pid)
+            elif len(fn) > 1 and fn.startswith("*") and not wildcards.search(fn[1:]):
+                self.suffix[fn[1:]].append(pid)
+            elif len(fn) > 1 and fn.endswith("*") and not wildcards.search(fn[:-1]):
+                self.prefix[fn[:-1]].append(pid)
+            else:
+                self.fn_globs.append((fnmatch.translate(fn), pid))
+        if sp.get("fn_re") is not None:
+            self.fn_regexes.append((sp["fn_re"], pid))
+
+    @staticmethod
+    def _combine(patterns):
+        """Compile a list of (regex, id) and return one regex that matches if any of them do"""
+        patterns[:] = [(re.compile(r), pid) for r, pid in patterns]
+        if len(patterns) == 0 or any(re.search(r"\\[1-9]|\(\?P=", r.pattern) for r, _ in patterns):
+            return None
+        try:
+            return re.compile("|".join("(?:{})".format(r.pattern) for r, _ in patterns))
+        except re.error:
+            return None
+
+    def candidates(self, *fns):
+        """
+        Find the search patterns which could match any of these filenames.
+        Returns a set of search pattern ids (see id(sp)) and a sorted
+        list of the positions of their search keys in the evaluation order.
+        """
+        pids = set(self.any_fn)
+        for fn in fns:
+            fn_norm = os.path.normcase(fn)
+            pids.update(self.literal.get(fn_norm, ()))
+            for n in self.suffix_lengths:
+                if n > len(fn_norm):
+                    break
+                pids.update(self.suffix.get(fn_norm[-n:], ()))
+            for n in self.prefix_lengths:
+                if n > len(fn_norm):
+                    break
+                pids.update(self.prefix.get(fn_norm[:n], ()))
+            if self.fn_globs_prefilter is None or self.fn_globs_prefilter.match(fn_norm):
+                pids.update(pid for r, pid in self.fn_globs if r.match(fn_norm))
+            if self.fn_regexes_prefilter is None or self.fn_regexes_prefilter.match(fn):
+                pids.update(pid for r, pid in self.fn_regexes if r.match(fn))
+        return pids, sorted(set(self.key_positions[pid] for pid in pids))
+
+
+class SearchFileContents(object):
+    """
+    Lazily read lines from a file being searched, keeping them in a buffer
+    so that the file is only opened and read once, no matter how many
+    search patterns test its contents.
+    Lines are only read as far as the most demanding pattern needs (num_lines).
+    If count_io is set, file reads are counted in io_stats against the search key set in sp_key.
+    """
+
+    def __init__(self, path, re_prefilter=None, opener=None, count_io=False):
+        self.path = path
+        # Function to open the file, if it isn't read from path (eg. files inside archives)
+        self.opener = opener
+        self.lines = list()
+        # Offset of the end of each line in the joined text
+        self.line_ends = list()
+        self.error = None
+        self.eof = False
+        # Search key currently using the file, and Counters of the file reads made for each key
+        self.sp_key = None
+        self.io_stats = dict() if count_io else None
+        self._fh = None
+        self._text = ""
+        # Optional compiled alternation of all contents_re patterns, with the set of patterns it covers
+        self._re_prefilter, self._re_prefilter_patterns = re_prefilter or (None, ())
+        self._re_prefilter_hits = list()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _count(self, stat_name, value=1):
+        """Add to a file read statistic for the current search key"""
+        if self.io_stats is not None:
+            self.io_stats.setdefault(self.sp_key, Counter())[stat_name] += value
+
+    def read_lines(self, num_lines=None):
+        """Make sure that the first num_lines lines are in the buffer (all lines if None)"""
+        if self.eof or (num_lines is not None and len(self.lines) >= num_lines):
+            return
+        num_lines_before = len(self.lines)
+        num_chars_before = self.line_ends[-1] if self.line_ends else 0
+        try:
+            if self._fh is None:
+                self._fh = self.opener() if self.opener is not None else util_functions.open_file(self.path)
+                self._count("files_opened")
+            for line in self._fh:
+                self.lines.append(line)
+                self.line_ends.append(len(line) + (self.line_ends[-1] if self.line_ends else 0))
+                if num_lines is not None and len(self.lines) >= num_lines:
+                    break
+            else:
+                self.eof = True
+        except util_functions.file_read_errors as e:
+            self.error = e
+            self.eof = True
+            if isinstance(e, UnicodeDecodeError):
+                self._count("decode_errors")
+        if self.io_stats is not None:
+            self._count("lines_read", len(self.lines) - num_lines_before)
+            self._count("bytes_read", (self.line_ends[-1] if self.line_ends else 0) - num_chars_before)
+        if self.eof:
+            self.close()
+
+    def _check_error(self, num_lines):
+        """Raise any read error if it stopped us reading the lines that were asked for"""
+        if self.error is not None and (num_lines is None or len(self.lines) < num_lines):
+            raise self.error
+
+    def contains(self, pattern, num_lines=None):
+        """Does the string pattern occur in the first num_lines lines?"""
+        self.read_lines(num_lines)
+        n = len(self.lines) if num_lines is None else min(num_lines, len(self.lines))
+        num_scanned = n
+        if "\n" in pattern:
+            # Can't search the joined text, as the pattern could match across lines
+            found = any(pattern in line for line in self.lines[:n])
+        elif n > 0:
+            if len(self._text) < self.line_ends[-1]:
+                self._text = "".join(self.lines)
+            pos = self._text.find(pattern, 0, self.line_ends[n - 1])
+            found = pos != -1
+            if found and self.io_stats is not None:
+                num_scanned = bisect.bisect_right(self.line_ends, pos) + 1
+        else:
+            found = False
+        if self.io_stats is not None:
+            self._count("lines_scanned", num_scanned)
+        if not found:
+            self._check_error(num_lines)
+        return found
+
+    def search(self, pattern, num_lines=None):
+        """Does the regex pattern match any of the first num_lines lines?"""
+        self.read_lines(num_lines)
+        n = len(self.lines) if num_lines is None else min(num_lines, len(self.lines))
+        repattern = re.compile(pattern)
+        prefilter = self._re_prefilter is not None and pattern in self._re_prefilter_patterns
+        if prefilter:
+            # Only test lines where at least one of the contents_re patterns matched
+            while len(self._re_prefilter_hits) < len(self.lines):
+                line = self.lines[len(self._re_prefilter_hits)]
+                self._re_prefilter_hits.append(self._re_prefilter.search(line) is not None)
+        found = False
+        num_scanned = n
+        for i in range(n):
+            if prefilter and not self._re_prefilter_hits[i]:
+                continue
+            if repattern.search(self.lines[i]):
+                found = True
+                num_scanned = i + 1
+                break
+        if self.io_stats is not None:
+            self._count("lines_scanned", num_scanned)
+        if not found:
+            self._check_error(num_lines)
+        return found
+
+
+def compile_contents_re_prefilter(patterns):
+    """
+    Combine contents_re search patterns into a single compiled alternation,
+    used to quickly skip lines that can't match any of them.
+    Returns a tuple of the compiled regex and the set of patterns that it covers.
+    """
+    covered = set()
+    for pattern in patterns:
+        # Back-references would point to the wrong group once combined
+        if re.search(r"\\[1-9]|\(\?P=", pattern):
+            continue
+        try:
+            re.compile(pattern)
+        except re.error:
+            continue
+        covered.add(pattern)
+    if len(covered) == 0:
+        return None
+    try:
+        prefilter = re.compile("|".join("(?:{})".format(p) for p in sorted(covered)))
+    except re.error:
+        # eg. inline global flags not at the start of the expression
+        return None
+    return prefilter, covered
+
+
+def search_filenames(fn):
+    """
+    Filenames to match search patterns against. If config.decompress_logs is set,
+    compressed files also match without their compression extension,
+    eg. 'ReadsPerGene.out.tab.gz' matches '*ReadsPerGene.out.tab'. Archives (eg. '.tar.gz') always keep theirs.
+    """
+    ext = util_functions.compression_ext(fn) if config.decompress_logs else None
+    if ext is None or archives.is_archive(fn):
+        return [fn]
+    return [fn, fn[: -len(ext)]]
+
+
+def exclude_file_type(f):
+    """
+    Use mimetypes to exclude binary files where possible.
+    Returns True if the file should not be searched.
+    """
+    if not re.match(r".+_mqc\.(png|jpg|jpeg)", f["fn"]) and config.ignore_images:
+        (ftype, encoding) = mimetypes.guess_type(os.path.join(f["root"], f["fn"]))
+        if encoding is not None and len(search_filenames(f["fn"])) == 1:
+            return True
+        if ftype is not None and ftype.startswith("image"):
+            return True
+    return False
+
+
+def search_file(pattern, f, module_key, contents=None, check_file_type=True):
     """
     Function to searach a single file for a single search pattern.
+    :param contents: A SearchFileContents object to share file reads between patterns
+    :param check_file_type: Set to False if exclude_file_type() has already been checked
     """
 
     fn_matched = False
     contents_matched = False
 
     # Use mimetypes to exclude binary files where possible
-    if not re.match(r".+_mqc\.(png|jpg|jpeg)", f["fn"]) and config.ignore_images:
-        (ftype, encoding) = mimetypes.guess_type(os.path.join(f["root"], f["fn"]))
-        if encoding is not None:
-            return False
-        if ftype is not None and ftype.startswith("image"):
-            return False
+    if check_file_type and exclude_file_type(f):
+        return False
 
     # Search pattern specific filesize limit
     if pattern.get("max_filesize") is not None and "filesize" in f:
@@ -299,57 +1238,51 @@ def search_file(pattern, f, module_key):
             return False
 
     # Search by file name (glob)
+    fns = search_filenames(f["fn"])
     if pattern.get("fn") is not None:
-        if fnmatch.fnmatch(f["fn"], pattern["fn"]):
+        if any(fnmatch.fnmatch(fn, pattern["fn"]) for fn in fns):
             fn_matched = True
             if pattern.get("contents") is None and pattern.get("contents_re") is None:
                 return True
 
     # Search by file name (regex)
     if pattern.get("fn_re") is not None:
-        if re.match(pattern["fn_re"], f["fn"]):
+        if any(re.match(pattern["fn_re"], fn) for fn in fns):
             fn_matched = True
             if pattern.get("contents") is None and pattern.get("contents_re") is None:
                 return True
 
     # Search by file contents
     if pattern.get("contents") is not None or pattern.get("contents_re") is not None:
-        if pattern.get("contents_re") is not None:
-            repattern = re.compile(pattern["contents_re"])
+        num_lines = pattern.get("num_lines") or None
+        own_contents = contents is None
+        if own_contents:
+            contents = SearchFileContents(os.path.join(f["root"], f["fn"]))
         try:
-            with io.open(os.path.join(f["root"], f["fn"]), "r", encoding="utf-8") as f:
-                l = 1
-                for line in f:
-                    # Search by file contents (string)
-                    if pattern.get("contents") is not None:
-                        if pattern["contents"] in line:
-                            contents_matched = True
-                            if pattern.get("fn") is None and pattern.get("fn_re") is None:
-                                return True
-                            break
-                    # Search by file contents (regex)
-                    elif pattern.get("contents_re") is not None:
-                        if re.search(repattern, line):
-                            contents_matched = True
-                            if pattern.get("fn") is None and pattern.get("fn_re") is None:
-                                return True
-                            break
-                    # Break if we've searched enough lines for this pattern
-                    if pattern.get("num_lines") and l >= pattern.get("num_lines"):
-                        break
-                    l += 1
-        except (IOError, OSError, ValueError, UnicodeDecodeError):
+            # Search by file contents (string)
+            if pattern.get("contents") is not None:
+                contents_matched = contents.contains(pattern["contents"], num_lines)
+            # Search by file contents (regex)
+            else:
+                contents_matched = contents.search(pattern["contents_re"], num_lines)
+            if contents_matched and pattern.get("fn") is None and pattern.get("fn_re") is None:
+                return True
+        except util_functions.file_read_errors:
             if config.report_readerrors:
                 logger.debug("Couldn't read file when looking for output: {}".format(f["fn"]))
                 return False
+        finally:
+            if own_contents:
+                contents.close()
 
     return fn_matched and contents_matched
 
 
-def exclude_file(sp, f):
+def exclude_file(sp, f, contents=None):
     """
     Exclude discovered files if they match the special exclude_
     search pattern keys
+    :param contents: A SearchFileContents object to share file reads between patterns
     """
     # Make everything a list if it isn't already
     for k in sp:
@@ -358,32 +1291,35 @@ def exclude_file(sp, f):
                 sp[k] = [sp[k]]
 
     # Search by file name (glob)
+    fns = search_filenames(f["fn"])
     if "exclude_fn" in sp:
         for pat in sp["exclude_fn"]:
-            if fnmatch.fnmatch(f["fn"], pat):
+            if any(fnmatch.fnmatch(fn, pat) for fn in fns):
                 return True
 
     # Search by file name (regex)
     if "exclude_fn_re" in sp:
         for pat in sp["exclude_fn_re"]:
-            if re.match(pat, f["fn"]):
+            if any(re.match(pat, fn) for fn in fns):
                 return True
 
     # Search the contents of the file
     if "exclude_contents" in sp or "exclude_contents_re" in sp:
-        # Compile regex patterns if we have any
-        if "exclude_contents_re" in sp:
-            sp["exclude_contents_re"] = [re.compile(pat) for pat in sp["exclude_contents_re"]]
-        with io.open(os.path.join(f["root"], f["fn"]), "r", encoding="utf-8") as fh:
-            for line in fh:
-                if "exclude_contents" in sp:
-                    for pat in sp["exclude_contents"]:
-                        if pat in line:
-                            return True
-                if "exclude_contents_re" in sp:
-                    for pat in sp["exclude_contents_re"]:
-                        if re.search(pat, line):
-                            return True
+        own_contents = contents is None
+        if own_contents:
+            contents = SearchFileContents(os.path.join(f["root"], f["fn"]))
+        try:
+            if "exclude_contents" in sp:
+                for pat in sp["exclude_contents"]:
+                    if contents.contains(pat):
+                        return True
+            if "exclude_contents_re" in sp:
+                for pat in sp["exclude_contents_re"]:
+                    if contents.search(pat):
+                        return True
+        finally:
+            if own_contents:
+                contents.close()
     return False
 
 
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+""" MultiQC parsed results cache. Remembers what modules parsed from each
+log file in a previous run, so that unchanged files don't have to be
+parsed again. Modules opt in with BaseMultiqcModule.cached_parse(). """
+
+from __future__ import print_function
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+
+from multiqc.utils import config
+
+logger = logging.getLogger(__name__)
+
+# Config options that change the sample names or contents that modules parse
+fingerprint_config = [
+    "version",
+    "fn_clean_exts",
+    "extra_fn_clean_exts",
+    "fn_clean_trim",
+    "extra_fn_clean_trim",
+    "fn_clean_sample_names",
+    "use_filename_as_sample_name",
+    "prepend_dirs",
+    "prepend_dirs_depth",
+    "prepend_dirs_sep",
+    "sample_names_replace",
+    "sample_names_replace_regex",
+    "sample_names_replace_exact",
+    "sample_names_replace_complete",
+    "decompress_logs",
+]
+
+# The cache opened by this process, if any
+_cache = None
+
+
+class ParseCache(object):
+    """
+    SQLite cache of parsed results, keyed by module, search key and file path.
+    Entries are only used if the file size, modification time and config
+    fingerprint are unchanged. New results are written to disk with save().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.new_entries = dict()
+        self.hits = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(module TEXT, sp_key TEXT, path TEXT, size INTEGER, mtime INTEGER, fingerprint TEXT, result BLOB, "
+            "PRIMARY KEY (module, sp_key, path))"
+        )
+        self.db.commit()
+
+    def get(self, key, st, fingerprint):
+        """Return (True, result) for an unchanged file, or (False, None)"""
+        row = self.db.execute(
+            "SELECT size, mtime, fingerprint, result FROM results WHERE module = ? AND sp_key = ? AND path = ?", key
+        ).fetchone()
+        if row is None or tuple(row[:3]) != (st.st_size, st.st_mtime_ns, fingerprint):
+            return False, None
+        try:
+            result = pickle.loads(row[3])
+        except Exception:
+            return False, None
+        self.hits += 1
+        return True, result
+
+    def set(self, key, st, fingerprint, result):
+        try:
+            self.new_entries[key] = (
+                st.st_size,
+                st.st_mtime_ns,
+                fingerprint,
+                pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+            )
+        except Exception as e:
+            logger.debug("Could not cache parsed results for {}: {}".format(key[2], e))
+
+    def save(self):
+        """Write new results to disk"""
+        if self.hits == 0 and len(self.new_entries) == 0:
+            return
+        if len(self.new_entries) > 0:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [key + entry for key, entry in self.new_entries.items()],
+            )
+            self.db.commit()
+        logger.debug("Parse cache: {} files unchanged, {} new or updated".format(self.hits, len(self.new_entries)))
+        self.new_entries = dict()
+        self.hits = 0
+
+    def close(self):
+        self.db.close()
+
+
+def get_cache():
+    """
+    The parse cache at config.parse_cache, or None if not set. A new connection
+    is opened in forked worker processes, as SQLite connections can't be shared.
+    """
+    global _cache
+    if not config.parse_cache:
+        return None
+    if _cache is None or _cache.pid != os.getpid() or _cache.path != config.parse_cache:
+        try:
+            _cache = ParseCache(config.parse_cache)
+        except sqlite3.Error as e:
+            logger.warning("Could not open parse cache '{}': {}".format(config.parse_cache, e))
+            config.parse_cache = None
+            _cache = None
+    return _cache
+
+
+def fingerprint(extra=None):
+    """Hash the config options that affect parsed results, plus any module-specific values"""
+    fp = {key: getattr(config, key, None) for key in fingerprint_config}
+    fp["extra"] = extra
+    fp_json = json.dumps(fp, sort_keys=True, default=str)
+    return hashlib.sha1(fp_json.encode("utf-8")).hexdigest()
+
+
+def save():
+    """Write results parsed by the last module to disk"""
+    if _cache is not None and _cache.pid == os.getpid():
+        try:
+            _cache.save()
+        except sqlite3.Error as e:
+            logger.warning("Could not save parse cache '{}': {}".format(_cache.path, e))
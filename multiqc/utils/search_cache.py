@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+""" MultiQC file search cache. Remembers which search patterns
+each file matched in a previous run, so that unchanged files
+don't have to be searched again. """
+
+from __future__ import print_function
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import stat
+import threading
+
+from multiqc.utils import config
+
+logger = logging.getLogger(__name__)
+
+
+def search_fingerprint(sp_order):
+    """
+    Hash everything that affects the file search results: the MultiQC version,
+    the search patterns being used (defaults, user 'sp:' config and which modules
+    are running) and the config options used to skip files or to look inside them.
+    """
+    fingerprint = {
+        "version": config.version,
+        "sp": sp_order,
+        "fn_ignore_files": config.fn_ignore_files,
+        "log_filesize_limit": config.log_filesize_limit,
+        "ignore_images": config.ignore_images,
+        "search_order_adaptive": config.search_order_adaptive,
+        "decompress_logs": config.decompress_logs,
+        "search_archives": config.search_archives,
+    }
+    fp_json = json.dumps(fingerprint, sort_keys=True, default=str)
+    return hashlib.sha1(fp_json.encode("utf-8")).hexdigest()
+
+
+class SearchCache(object):
+    """
+    SQLite file search cache, keyed by absolute file path.
+    Entries are only used if the file size, modification time and inode
+    are unchanged, and are all discarded if the search fingerprint changes.
+
+    The whole cache is read into memory when opened, so that lookups can be
+    done from the file search worker threads. New results are written to disk
+    with save(), which must be called from the thread that opened the cache.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.entries = dict()
+        self.new_entries = dict()
+        self.hits = 0
+        self.hits_lock = threading.Lock()
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files "
+            "(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, inode INTEGER, result TEXT)"
+        )
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            if row is not None:
+                logger.info("Search patterns or MultiQC version have changed, clearing file search cache")
+            self.db.execute("DELETE FROM files")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+            self.db.commit()
+        else:
+            for fn_path, size, mtime, inode, result in self.db.execute("SELECT * FROM files"):
+                self.entries[fn_path] = (size, mtime, inode, result)
+        logger.debug("Loaded {} entries from file search cache: {}".format(len(self.entries), path))
+
+    def get(self, path, st):
+        """
+        Return the cached add_file() result for a file, or None if the file
+        is not in the cache or has changed since.
+        """
+        entry = self.entries.get(path)
+        if entry is None or entry[:3] != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+        with self.hits_lock:
+            self.hits += 1
+        return json.loads(entry[3])
+
+    def set(self, path, st, result):
+        """Remember the add_file() result for a regular file"""
+        if stat.S_ISREG(st.st_mode):
+            self.new_entries[path] = (st.st_size, st.st_mtime_ns, st.st_ino, json.dumps(result))
+
+    def save(self):
+        """Write new results to disk and close the database"""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+            [(path,) + entry for path, entry in self.new_entries.items()],
+        )
+        self.db.commit()
+        self.db.close()
+        logger.debug(
+            "File search cache: {} files unchanged, {} new or updated".format(self.hits, len(self.new_entries))
+        )
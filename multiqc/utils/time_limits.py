@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+""" MultiQC module time limits. Stops a module that runs for longer than
+config.module_timeout seconds and removes anything that it had added to
+the report, so that the rest of the report can still be made. """
+
+from __future__ import print_function
+import copy
+import logging
+import os
+import signal
+import threading
+import time
+
+from multiqc.utils import config, report
+
+logger = logging.getLogger(__name__)
+
+# When the running module has to stop by, from time.time()
+_deadline = None
+
+
+class ModuleTimeout(BaseException):
+    """
+    Raised in a module that has run for longer than config.module_timeout.
+    Not an Exception, so that modules catching errors while parsing a file don't catch it.
+    """
+
+    def __init__(self, last_found_file=None):
+        super(ModuleTimeout, self).__init__(last_found_file)
+        self.last_found_file = last_found_file
+
+
+def _alarm_handler(signum, frame):
+    raise ModuleTimeout(report.last_found_file)
+
+
+def _can_alarm():
+    """Modules can only be interrupted with a timer signal on Unix, in the main thread"""
+    return hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+
+
+def start():
+    """
+    Start the time limit for a module, if config.module_timeout is set.
+    The module is interrupted with a timer signal where possible. Otherwise
+    (or if the module catches the interruption) it is stopped the next time it
+    asks find_log_files() for a file.
+    """
+    global _deadline
+    report.last_found_file = None
+    if not config.module_timeout or config.module_timeout <= 0:
+        _deadline = None
+        return
+    _deadline = time.time() + config.module_timeout
+    if _can_alarm():
+        signal.signal(signal.SIGALRM, _alarm_handler)
+        signal.setitimer(signal.ITIMER_REAL, config.module_timeout)
+
+
+def stop():
+    """Stop the time limit for the module"""
+    global _deadline
+    if _deadline is not None and _can_alarm():
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    _deadline = None
+
+
+def check():
+    """Raise ModuleTimeout if the running module has gone over its time limit"""
+    if _deadline is not None and time.time() > _deadline:
+        raise ModuleTimeout(report.last_found_file)
+
+
+def log_timeout(mod_name, e):
+    logger.warning(
+        "Module '{}' took longer than the {} second time limit (config.module_timeout) and was skipped{}".format(
+            mod_name,
+            config.module_timeout,
+            ". Last file: {}".format(e.last_found_file) if e.last_found_file else "",
+        )
+    )
+
+
+class ReportSnapshot(object):
+    """
+    The parts of the report that a module adds to, before the module runs.
+    rollback() removes anything added since, including data and plot files.
+    """
+
+    def __init__(self):
+        self.lists = {name: len(getattr(report, name)) for name in report.module_report_lists}
+        self.dicts = {name: set(getattr(report, name)) for name in report.module_report_dicts}
+        self.counts = {name: getattr(report, name) for name in report.module_report_counts}
+        self.modules_output = len(report.modules_output)
+        self.data_sources = copy.deepcopy(report.data_sources)
+        self.files = {dir_key: self._list_files(dir_key) for dir_key in ("data_dir", "plots_dir")}
+
+    @staticmethod
+    def _list_files(dir_key):
+        files = set()
+        output_dir = getattr(config, dir_key, None)
+        if output_dir is not None and os.path.isdir(output_dir):
+            for root, _, fns in os.walk(output_dir):
+                files.update(os.path.join(root, fn) for fn in fns)
+        return files
+
+    def rollback(self):
+        for name, length in self.lists.items():
+            del getattr(report, name)[length:]
+        for name, keys in self.dicts.items():
+            for key in set(getattr(report, name)) - keys:
+                del getattr(report, name)[key]
+        for name, value in self.counts.items():
+            setattr(report, name, value)
+        del report.modules_output[self.modules_output :]
+        report.data_sources.clear()
+        report.data_sources.update(self.data_sources)
+        for dir_key, files in self.files.items():
+            for path in self._list_files(dir_key) - files:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.debug("Could not remove '{}': {}".format(path, e))
@@ -3,16 +3,133 @@
 """ MultiQC Utility functions, used in a variety of places. """
 
 from __future__ import print_function
+import bz2
+import collections
+import concurrent.futures
+import gzip
 import io
 import json
+import lzma
 import os
 import yaml
 import time
 import shutil
 import sys
+import tarfile
+import zipfile
 
 from multiqc import config
 
+# Optional dependency for reading zstd-compressed files
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Exceptions that can be raised when reading (and decompressing) a log file
+file_read_errors = (
+    IOError,
+    OSError,
+    ValueError,
+    UnicodeDecodeError,
+    EOFError,
+    lzma.LZMAError,
+    tarfile.TarError,
+    zipfile.BadZipFile,
+)
+if zstandard is not None:
+    file_read_errors += (zstandard.ZstdError,)
+
+
+def compression_ext(fn):
+    """
+    Return the compression file extension (eg. '.gz') of a filename
+    if MultiQC can decompress it, otherwise None.
+    """
+    for ext in (".gz", ".bz2", ".xz", ".zst"):
+        if fn.endswith(ext):
+            if ext == ".zst" and zstandard is None:
+                return None
+            return ext
+    return None
+
+
+def open_file(path, mode="r", encoding="utf-8", fileobj=None):
+    """
+    Open a log file for reading. If config.decompress_logs is set, files with
+    a gzip, bzip2, xz or zstd (requires the zstandard package) file extension are
+    decompressed on the fly. Decompression is streamed, so only the part of the
+    file that is actually read is decompressed.
+    :param mode: 'r' for text (default) or 'rb' for binary
+    :param fileobj: Binary file object to read from instead of opening path,
+                    eg. a file inside an archive. path is then only used for the file extension.
+    :return: A file object
+    """
+    ext = compression_ext(path) if config.decompress_logs else None
+    if "b" in mode:
+        mode, encoding = "rb", None
+    else:
+        mode = "rt"
+    source = path if fileobj is None else fileobj
+    if ext == ".gz":
+        return gzip.open(source, mode, encoding=encoding)
+    elif ext == ".bz2":
+        return bz2.open(source, mode, encoding=encoding)
+    elif ext == ".xz":
+        return lzma.open(source, mode, encoding=encoding)
+    elif ext == ".zst":
+        return zstandard.open(source, mode, encoding=encoding)
+    if fileobj is not None:
+        return fileobj if mode == "rb" else io.TextIOWrapper(fileobj, encoding=encoding)
+    return io.open(path, mode.replace("t", ""), encoding=encoding)
+
+
+def iter_lines(fh):
+    """
+    Iterate over the lines of a text file object without their line endings,
+    like str.splitlines() but without reading the whole file into memory.
+    File objects opened by open_file() use universal newlines, so Windows (CRLF)
+    and old Mac (CR) line endings are already translated.
+    """
+    for line in fh:
+        if line.endswith("\n"):
+            line = line[:-1]
+        yield line
+
+
+def read_ahead(items, read, size, max_items, max_bytes):
+    """
+    Read items on a pool of threads ahead of when they are used, so that slow
+    reads (eg. on network filesystems) overlap with processing the previous items.
+    Up to max_items are read ahead, and no more than max_bytes (as given by size())
+    in total, but an item bigger than max_bytes is still read once nothing else is pending.
+    :param read: Function called with each item, in a thread
+    :param size: Function returning the approximate number of bytes read for an item
+    :return: Yields (item, future) in the same order as items. future.result()
+             returns the result of read(item), or raises its exception.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_items)
+    pending = collections.deque()
+    pending_bytes = 0
+    try:
+        for item in items:
+            item_bytes = size(item)
+            # Hand over items that have been read, until there's room for this one
+            while pending and (len(pending) >= max_items or pending_bytes + item_bytes > max_bytes):
+                done_item, future, done_bytes = pending.popleft()
+                pending_bytes -= done_bytes
+                yield done_item, future
+            pending.append((item, executor.submit(read, item), item_bytes))
+            pending_bytes += item_bytes
+        while pending:
+            done_item, future, _ = pending.popleft()
+            yield done_item, future
+    finally:
+        # Don't read any more if the caller stops early
+        for _, future, _ in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
 
 def robust_rmtree(path, logger=None, max_retries=10):
     """Robustly tries to delete paths.
@@ -38,6 +155,22 @@ def robust_rmtree(path, logger=None, max_retries=10):
     shutil.rmtree(path)
 
 
+def copy_tree(src, dst, preserve_metadata=True):
+    """Copy a directory tree, merging it into the destination directory if that exists already.
+    Replaces distutils' copy_tree, as distutils pulls in setuptools, which is slow to import.
+    :param preserve_metadata: Copy file permissions and modification times as well as contents
+    """
+    os.makedirs(dst, exist_ok=True)
+    for entry in os.scandir(src):
+        dst_path = os.path.join(dst, entry.name)
+        if entry.is_dir():
+            copy_tree(entry.path, dst_path, preserve_metadata)
+        elif preserve_metadata:
+            shutil.copy2(entry.path, dst_path)
+        else:
+            shutil.copyfile(entry.path, dst_path)
+
+
 def write_data_file(data, fn, sort_cols=False, data_format=None):
     """Write a data file to the report directory. Will not do anything
     if config.data_dir is not set.
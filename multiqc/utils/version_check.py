@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+""" MultiQC version check. Asks multiqc.info for the latest version of MultiQC
+in a background thread, so that a slow or blocked network never delays the run.
+The answer is cached on disk for config.version_check_ttl seconds and is logged
+when MultiQC finishes, using the previous answer if the new one isn't back yet. """
+
+from __future__ import print_function
+import json
+import logging
+import re
+import threading
+import time
+
+from multiqc.utils import cache_files, config
+
+logger = logging.getLogger(__name__)
+
+_thread = None
+_result = dict()
+
+
+def cache_path():
+    """Where the latest version is cached, in the user cache directory"""
+    return cache_files.cache_path("version_check.json")
+
+
+def _load_cache():
+    """The previous version check for the configured URL, or None"""
+    try:
+        with open(cache_path()) as fh:
+            cached = json.load(fh)
+        if isinstance(cached, dict) and cached.get("url") == config.version_check_url and cached.get("version"):
+            return cached
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _save_cache(remote_version):
+    """Save the latest version"""
+    cached = {"url": config.version_check_url, "version": remote_version, "time": time.time()}
+    try:
+        cache_files.write_atomic(cache_path(), lambda fh: json.dump(cached, fh))
+    except (IOError, OSError):
+        pass
+
+
+def _fetch(urlopen):
+    """Get the latest version from the version check URL. Runs in the background thread."""
+    try:
+        url = config.version_check_url
+        # Local stand-ins (eg. for testing offline) are read as they are
+        if not url.startswith("file:"):
+            url = "{}{}v={}".format(url, "&" if "?" in url else "?", config.short_version)
+        response = urlopen(url, timeout=config.version_check_timeout)
+        remote_version = response.read().decode("utf-8").strip()
+        if not _version_tuple(remote_version):
+            raise ValueError("Unexpected response: '{}'".format(remote_version[:100]))
+        _result["version"] = remote_version
+        _save_cache(remote_version)
+    except Exception as e:
+        _result["error"] = e
+
+
+def _version_tuple(version):
+    """Numeric parts of a version string, for comparing versions. eg. '1.12.dev0' -> (1, 12, 0)"""
+    return tuple(int(p) for p in re.sub(r"[^0-9\.]", "", version).split(".") if p)
+
+
+def start():
+    """
+    Start checking for a new version of MultiQC in the background, unless
+    config.no_version_check is set or the cached result is recent enough.
+    """
+    global _thread
+    if config.no_version_check is True or _thread is not None:
+        return
+    cached = _load_cache()
+    if cached is not None:
+        _result["cached"] = cached
+        if time.time() - cached.get("time", 0) < config.version_check_ttl:
+            logger.debug("Using cached version check from {}".format(time.ctime(cached.get("time", 0))))
+            return
+    # Imported before the thread starts, so that the thread isn't holding the import lock
+    # if module worker processes are forked while it's running
+    try:
+        from urllib.request import urlopen
+    except ImportError:
+        # Python 2
+        from urllib2 import urlopen
+
+    # Daemon thread, so that MultiQC can exit without waiting for it
+    _thread = threading.Thread(target=_fetch, args=(urlopen,), name="version_check")
+    _thread.daemon = True
+    _thread.start()
+
+
+def log_result():
+    """Log whether a newer version of MultiQC is available. Doesn't wait for a check that hasn't finished."""
+    if config.no_version_check is True:
+        return
+    remote_version = _result.get("version")
+    if remote_version is None:
+        if _thread is not None and _thread.is_alive():
+            logger.debug("Version check hasn't finished, not waiting for it")
+        elif "error" in _result:
+            logger.debug(
+                "Could not connect to {} for version check: {}".format(config.version_check_url, _result["error"])
+            )
+        if "cached" in _result:
+            remote_version = _result["cached"]["version"]
+    if remote_version is None:
+        return
+    if _version_tuple(remote_version) > _version_tuple(str(config.short_version)):
+        logger.warning("MultiQC Version {} now available!".format(remote_version))
+    else:
+        logger.debug("Latest MultiQC version is {}".format(remote_version))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+""" MultiQC YAML loading. Uses the libyaml C parser when PyYAML was built with it,
+and caches the parsed contents of config files on disk (pickled, keyed by a hash of
+the file contents) so that unchanged files don't have to be parsed every time
+MultiQC starts. """
+
+from __future__ import print_function
+import hashlib
+import os
+import pickle
+import sys
+
+import yaml
+
+from multiqc.utils import cache_files
+
+# Fastest available safe loader: the libyaml C parser, or the pure Python one
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parsed files kept in the cache directory
+max_cached = 100
+
+# Cache hits and misses, for debugging
+stats = {"hits": 0, "misses": 0}
+
+
+def safe_load(stream, loader=None):
+    """Same as yaml.safe_load(), but with the C parser when available"""
+    return yaml.load(stream, Loader=loader or SafeLoader)
+
+
+def cache_dir():
+    """
+    Where parsed files are cached: $MULTIQC_YAML_CACHE if set (empty to disable the cache),
+    otherwise in the user cache directory.
+    """
+    if "MULTIQC_YAML_CACHE" in os.environ:
+        return os.environ["MULTIQC_YAML_CACHE"] or None
+    return cache_files.cache_path("yaml")
+
+
+def _cache_key(contents, loader):
+    """Hash of the file contents, the loader and the versions that affect the pickled result"""
+    h = hashlib.sha1(contents)
+    h.update(
+        "{}.{}:{}:{}.{}".format(
+            loader.__module__, loader.__name__, yaml.__version__, sys.version_info[0], sys.version_info[1]
+        ).encode("utf-8")
+    )
+    return h.hexdigest()
+
+
+def _save(path, data):
+    """Pickle parsed contents to the cache, dropping the oldest files"""
+    try:
+        cache_files.write_atomic(path, lambda fh: pickle.dump(data, fh, protocol=pickle.HIGHEST_PROTOCOL), binary=True)
+        cached = [e for e in os.scandir(os.path.dirname(path)) if e.name.endswith(".pickle")]
+        if len(cached) > max_cached:
+            cached.sort(key=lambda e: e.stat().st_mtime)
+            for entry in cached[: len(cached) - max_cached]:
+                os.remove(entry.path)
+    except (IOError, OSError, pickle.PicklingError):
+        pass
+
+
+def load_file(path, loader=None):
+    """
+    Parse a YAML file, using the cached result if the file has been parsed before.
+    Raises the same errors as yaml.safe_load() if the file can't be parsed.
+    """
+    loader = loader or SafeLoader
+    with open(path, "rb") as fh:
+        contents = fh.read()
+    cache_path = None
+    if cache_dir():
+        cache_path = os.path.join(cache_dir(), _cache_key(contents, loader) + ".pickle")
+        try:
+            with open(cache_path, "rb") as fh:
+                data = pickle.load(fh)
+            stats["hits"] += 1
+            return data
+        except Exception:
+            # Not cached yet, or an unreadable cache file that will be replaced
+            pass
+    stats["misses"] += 1
+    # Parsed from the file, so that errors give its name
+    with open(path, "rb") as fh:
+        data = safe_load(fh, loader)
+    if cache_path is not None:
+        _save(cache_path, data)
+    return data
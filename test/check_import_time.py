@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+""" Checks how long MultiQC takes to import its dependencies, using python -X importtime.
+Fails if the total import time is over budget, or if a dependency that should only be
+imported when it's needed (eg. MatPlotLib) is imported anyway. """
+
+from __future__ import print_function
+import argparse
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+
+# Modules that shouldn't be imported by every MultiQC run
+DEFERRED_VERSION = ["matplotlib", "numpy", "spectra", "colormath2", "networkx", "requests", "jinja2", "rich.progress"]
+DEFERRED_RUN = ["matplotlib", "requests"]
+
+parser = argparse.ArgumentParser(description="Check the import time of 'multiqc --version' and of a MultiQC run")
+parser.add_argument("--max-time", type=float, default=1.0, help="Import time budget for 'multiqc --version' (seconds)")
+parser.add_argument("--run", help="Arguments for a MultiQC run to check as well, eg. 'data/fastqc -m fastqc'")
+parser.add_argument("--run-max-time", type=float, default=2.0, help="Import time budget for the run (seconds)")
+parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to print")
+args = parser.parse_args()
+
+
+def import_times(multiqc_args):
+    """Run MultiQC with -X importtime. Returns a dict of module name: (self, cumulative) microseconds"""
+    cmd = [sys.executable, "-X", "importtime", "-m", "multiqc"] + multiqc_args
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        sys.exit("Command failed: {}".format(" ".join(cmd)))
+    times = dict()
+    total = 0
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)", line)
+        if m:
+            times[m.group(4)] = (int(m.group(1)), int(m.group(2)))
+            # Top level imports have a single space before the name
+            if len(m.group(3)) == 1:
+                total += int(m.group(2))
+    return times, total / 1e6
+
+
+def check(name, multiqc_args, max_time, deferred):
+    times, total = import_times(multiqc_args)
+    print("\n{}: {:.3f}s importing {} modules (budget {:.3f}s)".format(name, total, len(times), max_time))
+    slowest = sorted(times.items(), key=lambda t: t[1][1], reverse=True)[: args.top]
+    for mod, (self_us, cumulative_us) in slowest:
+        print("    {:>8.1f} ms {:>8.1f} ms  {}".format(cumulative_us / 1000, self_us / 1000, mod))
+    errors = 0
+    if total > max_time:
+        print("Import time {:.3f}s is over budget ({:.3f}s)".format(total, max_time))
+        errors += 1
+    for mod in deferred:
+        if mod in times:
+            print("'{}' should not be imported, but was ({:.1f} ms)".format(mod, times[mod][1] / 1000))
+            errors += 1
+    return errors
+
+
+num_errors = check("multiqc --version", ["--version"], args.max_time, DEFERRED_VERSION)
+if args.run:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run_args = shlex.split(args.run) + ["-o", tmp_dir, "--quiet", "--no-ansi"]
+        num_errors += check("multiqc {}".format(args.run), run_args, args.run_max_time, DEFERRED_RUN)
+
+if num_errors > 0:
+    print("\nFound {} import time problems".format(num_errors))
+    sys.exit(1)
+print("\nImport times are within budget")